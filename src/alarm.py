@@ -1,49 +1,87 @@
-from datetime import datetime, timedelta
+import time
+
 from tinkerforge.bricklet_rgb_led_button import BrickletRGBLEDButton
 from tinkerforge.bricklet_piezo_speaker_v2 import BrickletPiezoSpeakerV2
 
+from commands import CommandCache
+from events import callback
+
 class Alarm:
-    def __init__(self, conn, count_down, trigger_timout_duration):
-        self.speaker = BrickletPiezoSpeakerV2("R7M", conn)
-        self.led_button = BrickletRGBLEDButton("23Qx", conn)
+    SPEAKER_UID = "R7M"
+    BUTTON_UID = "23Qx"
+
+    def __init__(self, conn, count_down, trigger_timout_duration, speaker_uid=SPEAKER_UID, button_uid=BUTTON_UID, button_conn=None, events=None,
+                 clock=time.monotonic):
+        self.speaker = BrickletPiezoSpeakerV2(speaker_uid, conn)
+        self.led_button = BrickletRGBLEDButton(button_uid, button_conn or conn)
+        # the alarm sounds until it is stopped, colors set in quick succession are sent by `update`
+        self._speaker_commands = CommandCache(self.speaker)
+        self._button_commands = CommandCache(self.led_button)
+        self._speaker_commands.post("set_alarm", 800, 2000, 10, 1, 1, 0, key="alarm")
+        self._button_commands.post("set_color", 0, 0, 0)
         self._is_triggered = False
         self._can_reset = False
         self._count_down = count_down
+        self._events = events
+        # the button is the fire button while a game is running
+        self._button_enabled = True
 
+        self._clock = clock
         self._trigger_timout_duration = trigger_timout_duration
-        self._trigger_timeout_start = datetime.now() - timedelta(seconds=trigger_timout_duration)
+        self._trigger_timeout_start = clock() - trigger_timout_duration
 
     def setup(self):
-        self.led_button.set_color(0, 0, 0)
-        self.led_button.register_callback(self.led_button.CALLBACK_BUTTON_STATE_CHANGED, self.button_callback)
+        self.led_button.register_callback(self.led_button.CALLBACK_BUTTON_STATE_CHANGED,
+                                          callback(self._events, "button", self.button_callback))
+        # sends the current color again, e.g. after a reconnect
+        self._button_commands.resync()
+
+    def setup_speaker(self):
+        self._speaker_commands.resync()
 
     def update(self):
-        if self._is_triggered:
-            self.speaker.set_alarm(800, 2000, 10, 1, 1, 200)
+        # also retries a speaker command which failed when it was sent, the alarm counts as triggered meanwhile;
+        # the colors still reach the button while the speaker is unreachable, the error is left to the caller
+        try:
+            self._speaker_commands.flush()
+        finally:
+            self._button_commands.flush()
 
     def trigger_alarm(self):
         if not self._is_triggered:
             self._is_triggered = True
-            self.led_button.set_color(255, 30, 30)
+            self._button_commands.post("set_color", 255, 30, 30)
+            self._speaker_commands.send("set_alarm", 800, 2000, 10, 1, 1, self.speaker.ALARM_DURATION_INFINITE, key="alarm")
 
     def can_trigger(self):
-        print("Timeout time (sec): " + str((datetime.now() - self._trigger_timeout_start).total_seconds()))
-        print("can't trigger")
-        return (datetime.now() - self._trigger_timeout_start).total_seconds() >= self._trigger_timout_duration
+        seconds = self._clock() - self._trigger_timeout_start
+        if seconds < self._trigger_timout_duration:
+            print(f"can't trigger, timeout time (sec): {seconds}")
+            return False
+        return True
             
+    def suspend_button(self):
+        self._button_enabled = False
+
+    def resume_button(self):
+        self._button_enabled = True
+
     def button_callback(self, state):
-        if self._can_reset and state == self.led_button.BUTTON_STATE_PRESSED:
+        if self._button_enabled and self._can_reset and state == self.led_button.BUTTON_STATE_PRESSED:
             print("Button pressed - resetting alarm and enabling motion detection")
 
-            self._trigger_timeout_start = datetime.now();
-            self.led_button.set_color(0, 0, 0)
+            self._trigger_timeout_start = self._clock()
+            self._button_commands.post("set_color", 0, 0, 0)
             self._is_triggered = False
             self._can_reset = False
 
             # Button-Press soll das System wieder in den normalen Zustand versetzen
             self._count_down.enable_motion_detection()
             self._count_down.reset_count_down()
+
+            # a duration of 0 stops the alarm, retried by `update` if it fails
+            self._speaker_commands.send("set_alarm", 800, 2000, 10, 1, 1, 0, key="alarm")
     
     def enable_reset(self):
-        self.led_button.set_color(30, 255, 30)
+        self._button_commands.post("set_color", 30, 255, 30)
         self._can_reset = True
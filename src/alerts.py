@@ -0,0 +1,182 @@
+import heapq
+import threading
+import time
+
+from metrics import METRICS
+
+class AlertRule:
+    """Fires while the value of a sensor is below `below` or above `above`, or while the sensor is critical if
+    neither is given.
+
+    The condition has to hold for `debounce` seconds before the alert fires. While it holds, a reminder is sent
+    every `cooldown` seconds (never if None), and once it held for `escalate_after` seconds the alert is sent
+    again as escalated.
+    """
+
+    def __init__(self, sensor, severity="critical", below=None, above=None, debounce=0, cooldown=300,
+                 escalate_after=None, notify_resolved=True):
+        self.sensor = sensor
+        self.severity = severity
+        self.below = below
+        self.above = above
+        self.debounce = debounce
+        self.cooldown = cooldown
+        self.escalate_after = escalate_after
+        self.notify_resolved = notify_resolved
+
+    def matches(self, reading):
+        if self.below is None and self.above is None:
+            return reading.is_critical
+        value = reading.current
+        return (self.below is not None and value < self.below) or (self.above is not None and value > self.above)
+
+    def describe(self, statistics, reading):
+        value = f"{statistics.title} is {reading.current}{statistics.unit}"
+        if self.below is not None and reading.current < self.below:
+            return f"{value} (below {self.below}{statistics.unit})"
+        if self.above is not None and reading.current > self.above:
+            return f"{value} (above {self.above}{statistics.unit})"
+        return value
+
+class _RuleState:
+    __slots__ = ("rule", "statistics", "reading", "active", "since", "fired", "escalated", "generation")
+
+    def __init__(self, rule):
+        self.rule = rule
+        self.statistics = None
+        self.reading = None
+        self.active = False
+        self.since = None
+        self.fired = False
+        self.escalated = False
+        # increased whenever the condition changes, so timers of an earlier activation are ignored
+        self.generation = 0
+
+class AlertEngine:
+    """Evaluates alert rules when a sensor value changes and sends the alerts in digests.
+
+    Only the rules of the changed sensor are evaluated. Debounce, reminder and escalation deadlines are kept in
+    a heap which `tick` works off. Alerts are collected for `digest_window` seconds after the first one and sent
+    as a single message.
+    """
+
+    def __init__(self, rules, send, digest_window=10, clock=time.monotonic):
+        self._send = send
+        self._digest_window = digest_window
+        self._clock = clock
+        self._lock = threading.Lock()
+
+        self._states = {}
+        for rule in rules:
+            self._states.setdefault(rule.sensor, []).append(_RuleState(rule))
+
+        # (due time, sequence, state, generation, kind)
+        self._timers = []
+        self._sequence = 0
+        # (time, text) of alerts which were not sent yet
+        self._pending = []
+
+        self.alerts = 0
+        self.digests = 0
+
+    def on_reading(self, statistics, reading):
+        """SensorData listener, runs on the thread which set the reading, the event dispatcher in the program."""
+        states = self._states.get(statistics.title)
+        if not states:
+            return
+
+        now = self._clock()
+        with self._lock:
+            for state in states:
+                state.statistics = statistics
+                state.reading = reading
+                matches = state.rule.matches(reading)
+
+                if matches and not state.active:
+                    state.active = True
+                    state.since = now
+                    state.generation += 1
+                    if state.rule.debounce > 0:
+                        self._schedule(now + state.rule.debounce, state, "fire")
+                    else:
+                        self._fire(state, now)
+
+                elif not matches and state.active:
+                    state.active = False
+                    state.generation += 1
+                    if state.fired and state.rule.notify_resolved:
+                        self._alert(now, f"resolved {state.rule.severity}: {state.rule.describe(statistics, reading)}")
+                    state.fired = False
+                    state.escalated = False
+
+    def tick(self):
+        """Fires due debounced alerts, reminders and escalations, and sends the digest once its window passed."""
+        now = self._clock()
+        message = None
+        with self._lock:
+            while self._timers and self._timers[0][0] <= now:
+                (_, _, state, generation, kind) = heapq.heappop(self._timers)
+                if generation != state.generation or not state.active:
+                    continue
+                if kind == "fire":
+                    self._fire(state, now)
+                elif kind == "remind":
+                    self._alert(now, f"still {state.rule.severity}: {state.rule.describe(state.statistics, state.reading)}")
+                    self._schedule(now + state.rule.cooldown, state, "remind")
+                elif kind == "escalate" and not state.escalated:
+                    state.escalated = True
+                    self._alert(now, f"ESCALATED {state.rule.severity}: {state.rule.describe(state.statistics, state.reading)}")
+
+            if self._pending and now - self._pending[0][0] >= self._digest_window:
+                message = self._digest()
+
+        # sent outside the lock, so a slow send doesn't hold up the readings on the event dispatcher
+        if message is not None:
+            self._send(message)
+
+    def flush(self):
+        """Sends the pending alerts without waiting for the digest window, e.g. before shutting down."""
+        with self._lock:
+            message = self._digest() if self._pending else None
+        if message is not None:
+            self._send(message)
+
+    def _digest(self):
+        lines = [text for (_, text) in self._pending]
+        self._pending.clear()
+        self.digests += 1
+        METRICS.count("alert_digests")
+        return lines[0] if len(lines) == 1 else f"{len(lines)} alerts:\n" + "\n".join(lines)
+
+    def _fire(self, state, now):
+        state.fired = True
+        self._alert(now, f"{state.rule.severity}: {state.rule.describe(state.statistics, state.reading)}")
+        if state.rule.cooldown is not None:
+            self._schedule(now + state.rule.cooldown, state, "remind")
+        if state.rule.escalate_after is not None:
+            self._schedule(state.since + state.rule.escalate_after, state, "escalate")
+
+    def _alert(self, now, text):
+        self._pending.append((now, text))
+        self.alerts += 1
+        METRICS.count("alerts")
+
+    def _schedule(self, due, state, kind):
+        self._sequence += 1
+        heapq.heappush(self._timers, (due, self._sequence, state, state.generation, kind))
+
+def rules_from_config(config, sensor_data, cooldown=300):
+    """Builds the rules of the "alerts" section of the config, e.g.
+    {"sensor": "ILLUMINANCE", "severity": "warning", "below": 100, "debounce": 10, "cooldown": 600}.
+
+    Without that section every sensor with critical bounds alerts while it is critical.
+    """
+    if "alerts" in config:
+        rules = [AlertRule(**rule) for rule in config["alerts"]]
+        titles = {data.title for data in sensor_data}
+        for rule in rules:
+            if rule.sensor not in titles:
+                raise ValueError(f"alert rule for unknown sensor {rule.sensor!r}, known are {', '.join(sorted(titles))}")
+        return rules
+    return [AlertRule(data.title, cooldown=cooldown) for data in sensor_data
+            if data.critical_min is not None or data.critical_max is not None]
@@ -0,0 +1,472 @@
+import argparse
+import json
+import threading
+import time
+import tracemalloc
+from statistics import quantiles
+
+BENCHMARKS = {}
+
+def benchmark(name):
+    """Registers a function that prepares a benchmark and returns the function to measure.
+
+    A `close` attribute of the returned function is called after measuring, e.g. to stop threads the setup started.
+    """
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+def measure(function, duration=1.0, allocation_samples=20):
+    """Calls `function` repeatedly for about `duration` seconds and returns throughput, latency and allocations."""
+    # warm up caches and lazily created buffers
+    function()
+
+    latencies = []
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration or len(latencies) < 10:
+        before = time.perf_counter()
+        function()
+        latencies.append(time.perf_counter() - before)
+    elapsed = time.perf_counter() - start
+
+    # peak memory allocated while the function runs, separately since tracing slows everything down
+    peaks = []
+    tracemalloc.start()
+    for _ in range(allocation_samples):
+        tracemalloc.reset_peak()
+        (current, _) = tracemalloc.get_traced_memory()
+        function()
+        peaks.append(tracemalloc.get_traced_memory()[1] - current)
+    tracemalloc.stop()
+
+    percentiles = quantiles(latencies, n=100)
+    return {
+        "calls": len(latencies),
+        "per_second": len(latencies) / elapsed,
+        "p50_us": percentiles[49] * 1e6,
+        "p95_us": percentiles[94] * 1e6,
+        "p99_us": percentiles[98] * 1e6,
+        "allocated_bytes": sum(peaks) / len(peaks),
+    }
+
+def load_doom_frames(path):
+    """Loads frames recorded with `doom.record_frames`, or synthetic ones if there is no recording."""
+    import numpy as np
+
+    try:
+        frames = np.load(path)
+        return list(zip(frames["screens"], frames["depths"]))
+    except FileNotFoundError:
+        print(f"{path} not found, using synthetic frames (record real ones with doom.record_frames)")
+
+    # in the resolution the game renders, doom.SCREEN_RESOLUTION
+    random = np.random.default_rng(0)
+    (y, x) = np.mgrid[0:192, 0:256]
+    frames = []
+    for i in range(30):
+        screen = random.integers(0, 256, (192, 256, 3), dtype=np.uint8) // 4
+        screen[:, :, i % 3] += ((x + 8 * i) % 256 // 2).astype(np.uint8)
+        depth = ((y * 255 // 192 + i) % 256).astype(np.uint8)
+        frames.append((screen, depth))
+    return frames
+
+def cycle(items):
+    """Returns a function that returns the next item on every call."""
+    state = {"index": 0}
+    def next_item():
+        item = items[state["index"] % len(items)]
+        state["index"] += 1
+        return item
+    return next_item
+
+def sensor_data(readings=1000):
+    """Returns sensor data with statistics windows already filled like after a few minutes of running."""
+    from sensor_data import SensorData
+
+    data = SensorData()
+    for i in range(readings):
+        for statistics in data:
+            statistics.set_current(20 + i % 100)
+    return data
+
+@benchmark("sensor_data.set_current")
+def bench_set_current(args):
+    statistics = sensor_data().temperature
+    next_value = cycle([20 + i / 10 for i in range(100)])
+    return lambda: statistics.set_current(next_value())
+
+@benchmark("sensor_data.set_current.contended")
+def bench_set_current_contended(args):
+    """set_current while other threads read snapshots, like the jobs do while callbacks arrive."""
+    data = sensor_data()
+    statistics = data.temperature
+    next_value = cycle([20 + i / 10 for i in range(100)])
+
+    stop = threading.Event()
+    def read():
+        while not stop.is_set():
+            for reading in data.snapshot():
+                reading.current
+            str(data)
+            time.sleep(0)
+    readers = [threading.Thread(target=read, name=f"reader-{i}", daemon=True) for i in range(3)]
+    for reader in readers:
+        reader.start()
+
+    def set_current():
+        statistics.set_current(next_value())
+    def close():
+        # the readers would compete with every later benchmark of the run
+        stop.set()
+        for reader in readers:
+            reader.join()
+    set_current.close = close
+    return set_current
+
+@benchmark("sensor_data.iterate")
+def bench_iterate(args):
+    data = sensor_data()
+    def iterate():
+        for statistics in data:
+            statistics.is_critical
+    return iterate
+
+@benchmark("sensor_data.getitem")
+def bench_getitem(args):
+    data = sensor_data()
+    def getitem():
+        for index in range(len(data)):
+            data[index].get_current()
+    return getitem
+
+@benchmark("timeseries.append")
+def bench_timeseries_append(args):
+    """Logging one reading into the raw ring and the minute and hour rollups, as the history listener does."""
+    import tempfile
+    from timeseries import TimeSeriesLog
+
+    directory = tempfile.TemporaryDirectory()
+    log = TimeSeriesLog(f"{directory.name}/history", raw_size=1024 * 1024, minute_size=64 * 1024, hour_size=64 * 1024)
+    names = [f"sensor {i}" for i in range(12)]
+    state = {"timestamp": 0.0}
+    def append():
+        state["timestamp"] += 0.25
+        log.append(names[int(state["timestamp"] * 4) % len(names)], 20.5, state["timestamp"])
+    def close():
+        log.close()
+        directory.cleanup()
+    append.close = close
+    return append
+
+@benchmark("alerts.on_reading")
+def bench_alerts(args):
+    """One sensor update with 1000 alert rules spread over 200 sensors, the value crossing a bound every time."""
+    from alerts import AlertEngine, AlertRule
+    from sensor_data import Reading, Statistics
+
+    sensors = [Statistics(f"sensor {i}", "C", 0, 100) for i in range(200)]
+    rules = [AlertRule(statistics.title, severity, above=bound, cooldown=None)
+             for statistics in sensors for (severity, bound) in
+             (("warning", 60), ("critical", 80), ("warning", 90), ("critical", 95), ("critical", 99))]
+    engine = AlertEngine(rules, send=lambda message: None)
+    next_update = cycle([(statistics, Reading(value, 0, 100, False)) for statistics in sensors for value in (50, 100)])
+    state = {"calls": 0}
+    def on_reading():
+        engine.on_reading(*next_update())
+        # sends the digest now and then like the alerts job, so the pending alerts don't grow over the run
+        state["calls"] += 1
+        if state["calls"] % 1000 == 0:
+            engine.flush()
+    return on_reading
+
+@benchmark("nfc.whitelist.lookup")
+def bench_whitelist_lookup(args):
+    """Looking up a tag as read from the reader in a whitelist of 100000 cards, every other tag unknown."""
+    import random
+    from whitelist import ROLES, TagWhitelist, parse
+
+    rng = random.Random(0)
+    tags = [[rng.randrange(256) for _ in range(7)] for _ in range(200000)]
+    whitelist = TagWhitelist(None)
+    whitelist._index = parse(f"{bytes(tag).hex()} {ROLES[i % 2]}" for (i, tag) in enumerate(tags[:100000]))
+    next_tag = cycle(tags[99000:101000])
+    return lambda: whitelist.lookup(next_tag())
+
+@benchmark("events.publish")
+def bench_events_publish(args):
+    """What a bricklet callback costs on the callback thread with the event bus, the dispatcher is not started."""
+    from events import EventBus
+
+    bus = EventBus()
+    motion = bus.callback("motion", lambda: None)
+    queue = bus._queue
+    def publish():
+        motion()
+        if len(queue) > 10000:
+            queue.clear()
+    return publish
+
+@benchmark("lcd.graph.normalize")
+def bench_graph_normalize(args):
+    """Recording a tick into the LCD history and normalising the graph, as `LCD_Display.tick` and `render` do."""
+    from history import SensorHistory
+
+    data = sensor_data()
+    history = SensorHistory(60)
+    for _ in range(60):
+        history.record(data)
+    graph = history[data.temperature.title]
+    def normalize():
+        history.record(data)
+        return graph.normalized(240)
+    return normalize
+
+@benchmark("doom.scale_and_dither")
+def bench_scale_and_dither(args):
+    from frame_pipeline import scale_and_dither
+
+    next_frame = cycle(load_doom_frames(args.frames))
+    return lambda: scale_and_dither(*next_frame())
+
+@benchmark("doom.frame_pipeline.bayer")
+def bench_frame_pipeline_bayer(args):
+    from frame_pipeline import FramePipeline
+
+    pipeline = FramePipeline(dither="bayer")
+    next_frame = cycle(load_doom_frames(args.frames))
+    return lambda: pipeline.process(*next_frame())
+
+@benchmark("doom.frame_pipeline.floyd_steinberg")
+def bench_frame_pipeline_floyd_steinberg(args):
+    from frame_pipeline import FramePipeline
+
+    pipeline = FramePipeline(dither="floyd-steinberg")
+    next_frame = cycle(load_doom_frames(args.frames))
+    return lambda: pipeline.process(*next_frame())
+
+@benchmark("doom.black_white_flat")
+def bench_black_white_flat(args):
+    """Packing a frame for the transport and flattening it into the pixel list `write_pixels` takes."""
+    import numpy as np
+    from frame_pipeline import FramePipeline
+
+    pipeline = FramePipeline()
+    frames = [pipeline.process(screen, depth).copy() for (screen, depth) in load_doom_frames(args.frames)[:30]]
+    next_frame = cycle(frames)
+    def black_white_flat():
+        packed = np.packbits(next_frame(), axis=None)
+        return np.unpackbits(packed, count=packed.size * 8).astype(bool).tolist()
+    return black_white_flat
+
+def compare(results, baseline, tolerance):
+    """Returns the names of benchmarks whose median latency got worse than the baseline by more than `tolerance`."""
+    regressions = []
+    for (name, result) in results.items():
+        if name in baseline and result["p50_us"] > baseline[name]["p50_us"] * (1 + tolerance):
+            regressions.append(name)
+    return regressions
+
+def check_frame_pipeline(args):
+    """Compares the tone of the fast frame pipeline with `scale_and_dither`, both blurred to hide dither patterns.
+
+    Returns the mean absolute difference (0 = same, 1 = inverted) per dithering.
+    """
+    import cv2
+    import numpy as np
+    from frame_pipeline import FramePipeline, scale_and_dither
+
+    # the reference divides by zero for frames with a flat depth buffer (e.g. while dead), so skip those
+    frames = [(screen, depth) for (screen, depth) in load_doom_frames(args.frames) if depth.min() != depth.max()]
+    differences = {}
+    for dither in ("bayer", "floyd-steinberg"):
+        pipeline = FramePipeline(dither=dither)
+        total = 0.0
+        for (screen, depth) in frames:
+            expected = cv2.blur(scale_and_dither(screen, depth).astype(np.float32), (5, 5))
+            actual = cv2.blur(pipeline.process(screen, depth).astype(np.float32), (5, 5))
+            total += float(np.abs(expected - actual).mean())
+        differences[dither] = total / len(frames)
+    return differences
+
+def check_sensor_data_snapshots(writers=4, pairs_per_writer=4, updates=2000, readers=2):
+    """Stress test of the sensor data: callbacks set values on several threads while other threads take snapshots.
+
+    Every writer owns pairs of sensors and sets the same increasing number on the first and then the second
+    sensor of a pair, so at any moment the first is at most one ahead. A snapshot which shows otherwise, or
+    which goes back in time, was not taken at a single moment. Returns (snapshots taken, problems found).
+    """
+    from sensor_data import SensorData, Statistics
+
+    data = SensorData()
+    pairs = [[data.add(Statistics(f"writer {w} pair {p} {side}", "", 0, updates)) for side in ("first", "second")]
+             for w in range(writers) for p in range(pairs_per_writer)]
+    # the indices of the pairs in the snapshot, after the three default sensors
+    indices = [3 + 2 * i for i in range(len(pairs))]
+    problems = []
+    done = threading.Event()
+    taken = [0] * readers
+
+    def write(own):
+        for value in range(1, updates + 1):
+            for (first, second) in own:
+                first.set_current(value)
+                second.set_current(value)
+
+    def read(reader):
+        last = [0] * len(pairs)
+        while not done.is_set():
+            snapshot = data.snapshot()
+            taken[reader] += 1
+            for (pair, index) in enumerate(indices):
+                (first, second) = (snapshot[index].current or 0, snapshot[index + 1].current or 0)
+                if not second <= first <= second + 1:
+                    problems.append(f"pair {pair}: first {first}, second {second}")
+                if first < last[pair]:
+                    problems.append(f"pair {pair}: went back from {last[pair]} to {first}")
+                last[pair] = first
+
+    threads = [threading.Thread(target=read, args=(reader,)) for reader in range(readers)]
+    for thread in threads:
+        thread.start()
+    threads_writing = [threading.Thread(target=write, args=(pairs[w * pairs_per_writer:(w + 1) * pairs_per_writer],))
+                       for w in range(writers)]
+    for thread in threads_writing:
+        thread.start()
+    for thread in threads_writing:
+        thread.join()
+    done.set()
+    for thread in threads:
+        thread.join()
+
+    final = data.snapshot()
+    if any(final[index].current != updates or final[index + 1].current != updates for index in indices):
+        problems.append("the last values are missing from the final snapshot")
+    return (sum(taken), problems)
+
+def check_timeseries_restart(capacity=100, readings=250):
+    """Fills a small time-series log past the end of its raw ring, reopens it like a restart and reads it back.
+
+    Another reading per sensor is logged after the restart within the last minute, the rollups have to count every
+    reading once. Returns the problems found, e.g. a header overlapping the first record.
+    """
+    import tempfile
+    from timeseries import TimeSeriesLog
+
+    problems = []
+    with tempfile.TemporaryDirectory() as directory:
+        path = f"{directory}/history"
+        raw_size = 512 + capacity * TimeSeriesLog.RAW.size
+        # timestamps like real ones, and a second sensor whose name is stored after the first records
+        timestamps = [1.7e9 + i * 0.37 for i in range(readings)]
+        names = ["temperature", "illuminance"]
+        sensors = [names[i % 2] if i > readings // 2 else names[0] for i in range(readings)]
+        log = TimeSeriesLog(path, raw_size=raw_size)
+        for (i, timestamp) in enumerate(timestamps):
+            log.append(sensors[i], i + 0.5, timestamp=timestamp)
+        log.close()
+
+        try:
+            log = TimeSeriesLog(path, raw_size=raw_size)
+        except (ValueError, UnicodeDecodeError) as e:
+            return [f"reopening failed with {type(e).__name__}"]
+        raw = log._files["raw"]
+        if log._names != names:
+            problems.append(f"names read back as {log._names}")
+        for index in range(raw.count):
+            i = readings - capacity + index
+            (timestamp, _, value) = raw[index]
+            if (timestamp, value) != (timestamps[i], i + 0.5):
+                problems.append(f"record {index} read back as ({timestamp}, {value}) instead of ({timestamps[i]}, {i + 0.5})")
+                break
+        for name in names:
+            log.append(name, 0.5, timestamp=timestamps[-1] + 0.01)
+        log.close()
+
+        log = TimeSeriesLog(path, raw_size=raw_size)
+        for name in names:
+            for resolution in log.RESOLUTIONS:
+                rollups = log.query(name, resolution=resolution)
+                counted = sum(count for (_, count, *_) in rollups)
+                if counted != sensors.count(name) + 1 or len({start for (start, *_) in rollups}) != len(rollups):
+                    problems.append(f"{resolution} rollups of {name} count {counted} readings in {len(rollups)} records "
+                                    f"instead of {sensors.count(name) + 1}")
+        log.close()
+    return problems
+
+def measure_frame_delta(args, interval=2):
+    """Returns the average bytes per frame of full and delta encoded LCD writes, for every `interval`-th frame."""
+    from frame_delta import DeltaEncoder, window_cost
+    from frame_pipeline import FramePipeline
+
+    pipeline = FramePipeline()
+    encoder = DeltaEncoder()
+    frames = load_doom_frames(args.frames)[::interval]
+
+    delta_bytes = 0
+    for (screen, depth) in frames:
+        delta_bytes += sum(window_cost(*window) for window in encoder.encode(pipeline.process(screen, depth)))
+    return (encoder.full_cost, delta_bytes / len(frames))
+
+# maximum blurred difference at which frames are considered visually equivalent
+MAX_FRAME_DIFFERENCE = 0.05
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs micro-benchmarks of the hot paths")
+    parser.add_argument("names", nargs="*", help=f"benchmarks to run, all by default: {', '.join(BENCHMARKS)}")
+    parser.add_argument("--duration", type=float, default=1.0, help="seconds per benchmark")
+    parser.add_argument("--frames", default="doom_frames.npz", help="recorded ViZDoom frames")
+    parser.add_argument("--save", metavar="PATH", help="write the results as baseline to a JSON file")
+    parser.add_argument("--baseline", metavar="PATH", help="compare the results with a saved baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed median slowdown against the baseline (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    names = args.names or list(BENCHMARKS)
+    results = {}
+    print(f"{'benchmark':40} {'calls/s':>10} {'p50 us':>10} {'p95 us':>10} {'p99 us':>10} {'alloc B':>10} {'vs base':>8}")
+    for name in names:
+        function = BENCHMARKS[name](args)
+        try:
+            result = results[name] = measure(function, args.duration)
+        finally:
+            getattr(function, "close", lambda: None)()
+        change = f"{result['p50_us'] / baseline[name]['p50_us'] - 1:+.0%}" if name in baseline else ""
+        print(f"{name:40} {result['per_second']:10.1f} {result['p50_us']:10.1f} {result['p95_us']:10.1f} {result['p99_us']:10.1f} {result['allocated_bytes']:10.0f} {change:>8}")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if any(name.startswith("doom.") for name in names):
+        differences = check_frame_pipeline(args)
+        for (dither, difference) in differences.items():
+            verdict = "equivalent" if difference <= MAX_FRAME_DIFFERENCE else "DIFFERENT"
+            print(f"frame pipeline ({dither}) vs scale_and_dither: mean blurred difference {difference:.3f} ({verdict})")
+
+        (full_bytes, delta_bytes) = measure_frame_delta(args)
+        print(f"LCD bytes per frame: {full_bytes} full, {delta_bytes:.0f} delta encoded ({full_bytes / (delta_bytes or 1):.1f}x less)")
+        if max(differences.values()) > MAX_FRAME_DIFFERENCE:
+            raise SystemExit(1)
+
+    if any(name.startswith("sensor_data.") for name in names):
+        (snapshots, problems) = check_sensor_data_snapshots()
+        print(f"sensor data snapshots under concurrent writers: {snapshots} taken, "
+              f"{'consistent' if not problems else f'{len(problems)} INCONSISTENT, e.g. {problems[0]}'}")
+        if problems:
+            raise SystemExit(1)
+
+    if any(name.startswith("timeseries.") for name in names):
+        problems = check_timeseries_restart()
+        print(f"time series after wrapping and reopening: {'intact' if not problems else f'BROKEN, {problems[0]}'}")
+        if problems:
+            raise SystemExit(1)
+
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"REGRESSION: slower than the baseline by more than {args.tolerance:.0%}: {', '.join(regressions)}")
+        raise SystemExit(1)
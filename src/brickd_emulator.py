@@ -0,0 +1,342 @@
+import heapq
+import inspect
+import math
+import re
+import socketserver
+import struct
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from functools import cache
+
+from tinkerforge.ip_connection import IPConnection, base58decode, pack_payload, unpack_payload
+from tinkerforge.bricklet_ambient_light_v3 import BrickletAmbientLightV3
+from tinkerforge.bricklet_dual_button_v2 import BrickletDualButtonV2
+from tinkerforge.bricklet_e_paper_296x128 import BrickletEPaper296x128
+from tinkerforge.bricklet_humidity_v2 import BrickletHumidityV2
+from tinkerforge.bricklet_lcd_128x64 import BrickletLCD128x64
+from tinkerforge.bricklet_motion_detector_v2 import BrickletMotionDetectorV2
+from tinkerforge.bricklet_nfc import BrickletNFC
+from tinkerforge.bricklet_piezo_speaker_v2 import BrickletPiezoSpeakerV2
+from tinkerforge.bricklet_ptc_v2 import BrickletPTCV2
+from tinkerforge.bricklet_rgb_led_button import BrickletRGBLEDButton
+from tinkerforge.bricklet_segment_display_4x7_v2 import BrickletSegmentDisplay4x7V2
+
+# the stack of the program by UID
+DEVICES = {
+    "Wcg": BrickletPTCV2,
+    "Pdw": BrickletAmbientLightV3,
+    "ViW": BrickletHumidityV2,
+    "24Rh": BrickletLCD128x64,
+    "24KJ": BrickletEPaper296x128,
+    "Tre": BrickletSegmentDisplay4x7V2,
+    "23Qx": BrickletRGBLEDButton,
+    "R7M": BrickletPiezoSpeakerV2,
+    "22ND": BrickletNFC,
+    "ML4": BrickletMotionDetectorV2,
+    "Vd8": BrickletDualButtonV2,
+}
+
+# sensor callbacks: configuration function, callback and the emulated value at a time in seconds
+SENSOR_CALLBACKS = {
+    BrickletPTCV2: ("set_temperature_callback_configuration", BrickletPTCV2.CALLBACK_TEMPERATURE,
+                    lambda t: round(2200 + 300 * math.sin(t / 60))),
+    BrickletAmbientLightV3: ("set_illuminance_callback_configuration", BrickletAmbientLightV3.CALLBACK_ILLUMINANCE,
+                             lambda t: round(30000 + 27000 * math.sin(t / 90))),
+    BrickletHumidityV2: ("set_humidity_callback_configuration", BrickletHumidityV2.CALLBACK_HUMIDITY,
+                         lambda t: round(4500 + 1000 * math.sin(t / 120))),
+}
+
+HEADER = struct.Struct("<IBBBB")
+ERROR_FUNCTION_NOT_SUPPORTED = 2
+
+_REQUEST = re.compile(r"send_request\(self, \w+\.(FUNCTION_\w+), .*?, '([^']*)', (\d+), '([^']*)'\)")
+
+@cache
+def functions(device_class):
+    """Returns {function_id: (name, request_form, response_length, response_form)}, read from the bindings."""
+    result = {}
+    for (constant, request_form, response_length, response_form) in _REQUEST.findall(inspect.getsource(device_class)):
+        name = constant[len("FUNCTION_"):].lower()
+        result[getattr(device_class, constant)] = (name, request_form, int(response_length), response_form)
+    return result
+
+class EmulatedDevice:
+    """A bricklet which answers getters with zeros unless a response was set."""
+
+    def __init__(self, uid, device_class, position="a"):
+        self.uid = uid
+        self.device_class = device_class
+        self.position = position
+        self.functions = functions(device_class)
+        self.callback_formats = device_class(uid, IPConnection()).callback_formats
+        # responses of getters by function name, as tuple with one value per response field
+        self.responses = {}
+
+    def response(self, name, length, form):
+        if name == "get_identity":
+            values = (self.uid, "0", self.position, (1, 0, 0), (2, 0, 0), self.device_class.DEVICE_IDENTIFIER)
+        elif name in self.responses:
+            values = self.responses[name]
+        else:
+            return bytes(length - HEADER.size)
+        return pack_payload(values, form)
+
+class BrickdEmulator:
+    """Local stand-in for brickd with the bricklets of the program, used to test and benchmark without hardware.
+
+    Sensor callbacks are sent with the period the program configures, or `rate` times per second if set.
+    Every request is recorded with its arguments.
+    """
+
+    def __init__(self, devices=DEVICES, host="127.0.0.1", port=4223, rate=None):
+        self.devices = {base58decode(uid): EmulatedDevice(uid, device_class) for (uid, device_class) in devices.items()}
+        self.rate = rate
+
+        # (monotonic time, uid, function name, arguments) of every request
+        self.rpcs = []
+        self.rpc_counts = Counter()
+        # (monotonic time, uid, callback id) of every callback sent
+        self.callbacks = []
+        self._started = time.monotonic()
+
+        self._clients = {}
+        self._clients_lock = threading.Lock()
+
+        # (due time, sequence, action) of timed callbacks
+        self._timers = []
+        self._timer_sequence = 0
+        self._condition = threading.Condition()
+        self._closed = False
+        # configured sensor streams by uid, a new configuration replaces the running stream
+        self._streams = {}
+
+        emulator = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                emulator._serve(self.request)
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self._server = socketserver.ThreadingTCPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._server_thread = threading.Thread(target=self._server.serve_forever, name="brickd-emulator", daemon=True)
+        self._timer_thread = threading.Thread(target=self._run_timers, name="brickd-emulator-timers", daemon=True)
+
+    @property
+    def address(self):
+        return self._server.server_address[:2]
+
+    def start(self):
+        self._server_thread.start()
+        self._timer_thread.start()
+        return self
+
+    def stop(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._server.shutdown()
+        self._server.server_close()
+        with self._clients_lock:
+            for connection in self._clients:
+                connection.close()
+
+    def _serve(self, connection):
+        with self._clients_lock:
+            self._clients[connection] = threading.Lock()
+
+        pending = b""
+        try:
+            while data := connection.recv(8192):
+                pending += data
+                while len(pending) >= HEADER.size and len(pending) >= pending[4]:
+                    length = pending[4]
+                    (packet, pending) = (pending[:length], pending[length:])
+                    self._handle(connection, packet)
+        except OSError:
+            pass
+        finally:
+            with self._clients_lock:
+                self._clients.pop(connection, None)
+
+    def _handle(self, connection, packet):
+        (uid, length, function_id, sequence_and_options, _) = HEADER.unpack_from(packet)
+        response_expected = sequence_and_options & 0x08
+
+        if uid == 0:
+            if function_id == IPConnection.FUNCTION_ENUMERATE:
+                for device in self.devices.values():
+                    payload = pack_payload((device.uid, "0", device.position, (1, 0, 0), (2, 0, 0),
+                                            device.device_class.DEVICE_IDENTIFIER, IPConnection.ENUMERATION_TYPE_AVAILABLE),
+                                           "8s 8s c 3B 3B H B")
+                    self._send(connection, base58decode(device.uid), IPConnection.CALLBACK_ENUMERATE, 0, payload)
+            # the disconnect probe needs no answer
+            return
+
+        device = self.devices.get(uid)
+        if device is None:
+            # like brickd, requests to unknown devices time out
+            return
+
+        if function_id not in device.functions:
+            if response_expected:
+                self._send(connection, uid, function_id, sequence_and_options, b"", ERROR_FUNCTION_NOT_SUPPORTED)
+            return
+
+        (name, request_form, response_length, response_form) = device.functions[function_id]
+        arguments = unpack_payload(packet[HEADER.size:], request_form) if request_form else ()
+        self.rpcs.append((time.monotonic(), device.uid, name, arguments))
+        self.rpc_counts[(device.uid, name)] += 1
+        self._react(device, name, arguments)
+
+        if response_expected or response_length:
+            payload = device.response(name, response_length, response_form) if response_length else b""
+            self._send(connection, uid, function_id, sequence_and_options, payload)
+
+    def _send(self, connection, uid, function_id, sequence_and_options, payload, error_code=0):
+        packet = HEADER.pack(uid, HEADER.size + len(payload), function_id, sequence_and_options, error_code << 6) + payload
+        with self._clients_lock:
+            lock = self._clients.get(connection)
+        if lock is None:
+            return
+        with lock:
+            try:
+                connection.sendall(packet)
+            except OSError:
+                pass
+
+    def _react(self, device, name, arguments):
+        """Emulates the side effects of requests which the program relies on."""
+        stream = SENSOR_CALLBACKS.get(device.device_class)
+        if stream is not None and name == stream[0]:
+            period = 1 / self.rate if self.rate else arguments[0] / 1000
+            self._start_stream(device, stream[1], stream[2], period, value_has_to_change=arguments[1])
+
+        elif device.device_class is BrickletSegmentDisplay4x7V2 and name == "start_counter":
+            (value_from, value_to, increment, length) = arguments
+            steps = abs(value_to - value_from) // max(abs(increment), 1)
+            self._schedule(steps * length / 1000,
+                           lambda: self.emit(device.uid, BrickletSegmentDisplay4x7V2.CALLBACK_COUNTER_FINISHED))
+
+    def emit(self, uid, callback_id, *values):
+        """Sends a callback of a device to all connected clients."""
+        device = self.devices[base58decode(uid)]
+        form = device.callback_formats[callback_id][1]
+        payload = pack_payload(values, form) if form else b""
+
+        self.callbacks.append((time.monotonic(), uid, callback_id))
+        with self._clients_lock:
+            connections = list(self._clients)
+        for connection in connections:
+            self._send(connection, base58decode(uid), callback_id, 0, payload)
+
+    def _devices(self, device_class):
+        return [device for device in self.devices.values() if device.device_class is device_class]
+
+    def motion(self):
+        for device in self._devices(BrickletMotionDetectorV2):
+            self.emit(device.uid, BrickletMotionDetectorV2.CALLBACK_MOTION_DETECTED)
+
+    def press_button(self, pressed=True):
+        state = BrickletRGBLEDButton.BUTTON_STATE_PRESSED if pressed else BrickletRGBLEDButton.BUTTON_STATE_RELEASED
+        for device in self._devices(BrickletRGBLEDButton):
+            self.emit(device.uid, BrickletRGBLEDButton.CALLBACK_BUTTON_STATE_CHANGED, state)
+
+    def press_dual_button(self, left=False, right=False):
+        states = [BrickletDualButtonV2.BUTTON_STATE_PRESSED if pressed else BrickletDualButtonV2.BUTTON_STATE_RELEASED
+                  for pressed in (left, right)]
+        for device in self._devices(BrickletDualButtonV2):
+            self.emit(device.uid, BrickletDualButtonV2.CALLBACK_STATE_CHANGED, *states, 0, 0)
+
+    def select_tab(self, index):
+        for device in self._devices(BrickletLCD128x64):
+            self.emit(device.uid, BrickletLCD128x64.CALLBACK_GUI_TAB_SELECTED, index)
+
+    def scan_tag(self, tag_id, tag_type=0):
+        """Presents an NFC tag, the program reads its ID once the reader reports it as ready."""
+        tag_id = list(tag_id)
+        for device in self._devices(BrickletNFC):
+            device.responses["reader_get_tag_id_low_level"] = (tag_type, len(tag_id), tag_id + [0] * (32 - len(tag_id)))
+            self.emit(device.uid, BrickletNFC.CALLBACK_READER_STATE_CHANGED, BrickletNFC.READER_STATE_REQUEST_TAG_ID_READY, True)
+
+    def _schedule(self, delay, action):
+        with self._condition:
+            self._timer_sequence += 1
+            heapq.heappush(self._timers, (time.monotonic() + delay, self._timer_sequence, action))
+            self._condition.notify()
+
+    def _start_stream(self, device, callback_id, value, period, value_has_to_change=False):
+        with self._condition:
+            generation = self._streams.get(device.uid, 0) + 1
+            self._streams[device.uid] = generation
+        if period <= 0:
+            return
+
+        last = [None]
+        def send(due):
+            if self._streams.get(device.uid) != generation:
+                return
+            current = value(time.monotonic() - self._started)
+            if not value_has_to_change or current != last[0]:
+                self.emit(device.uid, callback_id, current)
+                last[0] = current
+            # keep the rate even if a callback was late
+            next_due = max(due + period, time.monotonic() - period)
+            with self._condition:
+                self._timer_sequence += 1
+                heapq.heappush(self._timers, (next_due, self._timer_sequence, lambda: send(next_due)))
+
+        due = time.monotonic() + period
+        self._schedule(period, lambda: send(due))
+
+    def _run_timers(self):
+        while True:
+            with self._condition:
+                while not self._closed and (not self._timers or self._timers[0][0] > time.monotonic()):
+                    self._condition.wait(self._timers[0][0] - time.monotonic() if self._timers else None)
+                if self._closed:
+                    return
+                (_, _, action) = heapq.heappop(self._timers)
+            action()
+
+    def latencies(self, sink_uids):
+        """Seconds from each callback until the next request to one of `sink_uids`, e.g. the displays."""
+        sink_times = [timestamp for (timestamp, uid, _, _) in self.rpcs if uid in sink_uids]
+        latencies = []
+        for (timestamp, _, _) in self.callbacks:
+            index = bisect_left(sink_times, timestamp)
+            if index < len(sink_times):
+                latencies.append(sink_times[index] - timestamp)
+        return latencies
+
+if __name__ == "__main__":
+    import argparse
+    from statistics import quantiles
+
+    parser = argparse.ArgumentParser(description="Emulates brickd with the bricklets of the program and reports the traffic")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=4223)
+    parser.add_argument("--rate", type=float, help="sensor callbacks per second, instead of the configured periods")
+    parser.add_argument("--duration", type=float, help="seconds to run, until Ctrl+C by default")
+    args = parser.parse_args()
+
+    emulator = BrickdEmulator(host=args.host, port=args.port, rate=args.rate).start()
+    print(f"brickd emulator listening on {args.host}:{args.port}")
+    start = time.monotonic()
+    try:
+        time.sleep(args.duration) if args.duration else threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    elapsed = time.monotonic() - start
+    emulator.stop()
+
+    print(f"\r{len(emulator.callbacks)} callbacks sent, {len(emulator.rpcs)} requests ({len(emulator.rpcs) / elapsed:.1f}/s)")
+    for ((uid, name), count) in emulator.rpc_counts.most_common():
+        print(f"  {uid:5} {name:45} {count:8} {count / elapsed:10.1f}/s")
+    for (title, uids) in (("LCD", {"24Rh"}), ("e-paper", {"24KJ"})):
+        latencies = emulator.latencies(uids)
+        if len(latencies) >= 2:
+            p50, p95 = (quantiles(latencies, n=100)[i] * 1000 for i in (49, 94))
+            print(f"callback to {title} request: p50 {p50:.1f} ms, p95 {p95:.1f} ms")
@@ -0,0 +1,75 @@
+import threading
+
+from metrics import METRICS
+
+class CommandCache:
+    """Sends setter commands to a bricklet only if they change what the bricklet holds.
+
+    Every command sets the state of a key, by default the function name. `send` sends a changed state at once,
+    `post` only records it, so rapid changes are coalesced into the latest state by the next `flush`.
+    `resync` sends every state again, e.g. after a reconnect. A state which failed to send, also by `send`, stays
+    wanted and is only sent again by the next `flush` or `resync`, so the owner has to flush regularly to retry.
+    """
+
+    def __init__(self, device):
+        self._device = device
+        self._lock = threading.Lock()
+        # (function name, arguments) by key, as wanted and as last sent successfully
+        self._wanted = {}
+        self._sent = {}
+
+        self.sent = 0
+        # commands which repeated the state the bricklet holds
+        self.skipped = 0
+        # posted states which were replaced before they were sent
+        self.coalesced = 0
+
+    def send(self, name, *args, key=None):
+        with self._lock:
+            self._wanted[key or name] = (name, args)
+            if not self._flush(key or name):
+                self.skipped += 1
+                METRICS.count("actuator_commands", (("result", "skipped"),))
+
+    def post(self, name, *args, key=None):
+        key = key or name
+        with self._lock:
+            previous = self._wanted.get(key)
+            if (name, args) == self._sent.get(key):
+                self.skipped += 1
+                METRICS.count("actuator_commands", (("result", "skipped"),))
+            elif previous is not None and previous != self._sent.get(key):
+                self.coalesced += 1
+                METRICS.count("actuator_commands", (("result", "coalesced"),))
+            self._wanted[key] = (name, args)
+
+    def flush(self):
+        with self._lock:
+            for key in list(self._wanted):
+                self._flush(key)
+
+    def resync(self):
+        with self._lock:
+            self._sent.clear()
+            for key in list(self._wanted):
+                self._flush(key)
+
+    def forget(self, key):
+        """Drops the state of a key which the bricklet changes on its own, so the next command is sent."""
+        with self._lock:
+            self._wanted.pop(key, None)
+            self._sent.pop(key, None)
+
+    def _flush(self, key):
+        # called with the lock held, so commands reach the bricklet in the order their states were set
+        command = self._wanted[key]
+        if self._sent.get(key) == command:
+            return False
+
+        (name, args) = command
+        # if this fails, the state stays wanted and is not marked as sent, see the class docstring
+        getattr(self._device, name)(*args)
+        self._sent[key] = command
+        self.sent += 1
+        METRICS.count("actuator_commands", (("result", "sent"),))
+        return True
@@ -0,0 +1,98 @@
+import importlib
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, the profile has no memory column there
+    resource = None
+
+class StartupProfile:
+    """Import and initialisation time of every component, from the first import of this module on.
+
+    `main.py` imports this module first, so the times are measured from the start of the program.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self._clock = clock
+        self.started = clock()
+        # printed as components are loaded if set, e.g. with OBSERVER_PROFILE=1
+        self.verbose = False
+        # (name, import seconds, init seconds, seconds since the start, peak RSS in KiB or None) in the order of loading
+        self.entries = []
+        self._lock = threading.Lock()
+
+    def elapsed(self):
+        return self._clock() - self.started
+
+    def record(self, name, imported, initialised):
+        # ru_maxrss is in KiB on Linux
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource is not None else None
+        entry = (name, imported, initialised, self.elapsed(), rss)
+        with self._lock:
+            self.entries.append(entry)
+        if self.verbose:
+            print(self._format(entry))
+
+    def step(self, name):
+        """Times the initialisation of an eagerly created component: `with STARTUP.step("sensors"): ...`"""
+        return _Step(self, name)
+
+    def report(self):
+        lines = [f"{'component':20} {'import ms':>10} {'init ms':>10} {'at ms':>10} {'peak RSS':>10}"]
+        with self._lock:
+            lines.extend(self._format(entry) for entry in self.entries)
+        return "\n".join(lines)
+
+    def _format(self, entry):
+        (name, imported, initialised, at, rss) = entry
+        memory = f"{rss / 1024:8.1f}MB" if rss is not None else f"{'-':>10}"
+        return f"{name:20} {imported * 1000:10.1f} {initialised * 1000:10.1f} {at * 1000:10.1f} {memory}"
+
+class _Step:
+    def __init__(self, profile, name):
+        self._profile = profile
+        self._name = name
+
+    def __enter__(self):
+        self._start = self._profile._clock()
+
+    def __exit__(self, *exc_info):
+        self._profile.record(self._name, 0, self._profile._clock() - self._start)
+
+STARTUP = StartupProfile()
+
+class Component:
+    """A subsystem which is only imported and initialised on first use, e.g. the Doom supervisor.
+
+    `get` imports `module` and returns `factory(module)`, once and from any thread; `loaded` tells whether that
+    happened without doing it. The time of both steps is recorded in the startup profile.
+    """
+
+    def __init__(self, name, module, factory, profile=STARTUP):
+        self.name = name
+        self._module = module
+        self._factory = factory
+        self._profile = profile
+        self._instance = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._instance is not None
+
+    def get(self):
+        instance = self._instance
+        if instance is not None:
+            return instance
+
+        with self._lock:
+            if self._instance is None:
+                start = time.perf_counter()
+                module = importlib.import_module(self._module)
+                imported = time.perf_counter()
+                instance = self._factory(module)
+                self._profile.record(self.name, imported - start, time.perf_counter() - imported)
+                self._instance = instance
+            return self._instance
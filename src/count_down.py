@@ -1,15 +1,31 @@
 from tinkerforge.bricklet_segment_display_4x7_v2 import BrickletSegmentDisplay4x7V2
 
+from commands import CommandCache
+from events import callback
+
 class CountDown:
-    def __init__(self, conn):
-        self.segment_display = BrickletSegmentDisplay4x7V2("Tre", conn)
-        self.segment_display.register_callback(self.segment_display.CALLBACK_COUNTER_FINISHED, self._count_down_ended)
+    UID = "Tre"
+
+    def __init__(self, conn, uid=UID, events=None):
+        self.segment_display = BrickletSegmentDisplay4x7V2(uid, conn)
+        self.segment_display.register_callback(self.segment_display.CALLBACK_COUNTER_FINISHED,
+                                               callback(events, "count_down", self._count_down_ended))
         self.allow_cool_down = True
+        self.motion_detection_enabled = True
+        # called when the running count down ends
+        self._callback = None
+        self._commands = CommandCache(self.segment_display)
+
+    def setup(self):
+        """Shows the last value again, e.g. after a reconnect."""
+        self._commands.resync()
 
     def start_count_down(self, count_down, callback):
         if self.allow_cool_down:
             self.allow_cool_down = False
             self.segment_display.start_counter(count_down, 0, -1, 1000)
+            # the counter changes the shown value on its own
+            self._commands.forget("value")
             self._callback = callback
 
     def _count_down_ended(self):
@@ -23,7 +39,7 @@ class CountDown:
 
     def stop_count_down(self):
         print("Stopping countdown")
-        self.segment_display.set_numeric_value([0,0,0,0])
+        self._commands.send("set_numeric_value", [0,0,0,0], key="value")
         self._callback = None
 
     def disable_motion_detection(self):
@@ -0,0 +1,194 @@
+import copy
+import json
+import os
+import time
+
+from tinkerforge.ip_connection import Error, IPConnection
+from tinkerforge.bricklet_ambient_light_v3 import BrickletAmbientLightV3
+from tinkerforge.bricklet_humidity_v2 import BrickletHumidityV2
+from tinkerforge.bricklet_ptc_v2 import BrickletPTCV2
+
+import events
+from sampling import AdaptiveSampler
+from sensor_data import SENSOR_TYPES, Statistics
+
+# read from the working directory if it exists, OBSERVER_CONFIG points to another file
+CONFIG_PATH = "observer.json"
+
+# the single stack the program was built for, used without a config file
+DEFAULT_CONFIG = {
+    "hosts": {
+        "main": {"host": "172.20.10.242", "port": 4223},
+    },
+    "devices": {
+        "lcd": {"uid": "24Rh"},
+        "paper": {"uid": "24KJ"},
+        "speaker": {"uid": "R7M"},
+        "button": {"uid": "23Qx"},
+        "segment_display": {"uid": "Tre"},
+        "nfc": {"uid": "22ND"},
+        "motion": {"uid": "ML4"},
+        "dual_button": {"uid": "Vd8"},
+    },
+    "sensors": [
+        {"type": "temperature", "uid": "Wcg"},
+        {"type": "illuminance", "uid": "Pdw"},
+        {"type": "moisture", "uid": "ViW"},
+    ],
+}
+
+# bricklet, callback, callback configuration function and divisor of the raw value per sensor type
+SENSOR_BRICKLETS = {
+    "temperature": (BrickletPTCV2, BrickletPTCV2.CALLBACK_TEMPERATURE, "set_temperature_callback_configuration", 100),
+    "illuminance": (BrickletAmbientLightV3, BrickletAmbientLightV3.CALLBACK_ILLUMINANCE, "set_illuminance_callback_configuration", 100),
+    "moisture": (BrickletHumidityV2, BrickletHumidityV2.CALLBACK_HUMIDITY, "set_humidity_callback_configuration", 100),
+}
+
+# fixed callback period in ms of sensors with a "period", the adaptive sampling is compared to it
+DEFAULT_PERIOD = 1000
+# fast sampling starts this fraction of the sensor range before a critical bound, unless a "margin" is configured
+DEFAULT_MARGIN = 0.1
+
+def load_config(path=None):
+    """Reads the config file, or returns the default stack if there is none.
+
+    Without a config file, BRICKD_HOST replaces the host of the default stack, e.g. for brickd_emulator.py.
+    """
+    path = path or os.environ.get("OBSERVER_CONFIG", CONFIG_PATH)
+    if os.path.exists(path):
+        with open(path) as f:
+            config = json.load(f)
+    else:
+        config = copy.deepcopy(DEFAULT_CONFIG)
+        config["hosts"]["main"]["host"] = os.environ.get("BRICKD_HOST", config["hosts"]["main"]["host"])
+
+    if not config.get("hosts"):
+        raise ValueError(f"{path}: no brickd hosts configured")
+    for entry in list(config.get("devices", {}).values()) + config.get("sensors", []):
+        if entry.setdefault("host", next(iter(config["hosts"]))) not in config["hosts"]:
+            raise ValueError(f"{path}: unknown host {entry['host']!r} of {entry['uid']}")
+    for sensor in config.get("sensors", []):
+        if sensor["type"] not in SENSOR_BRICKLETS:
+            raise ValueError(f"{path}: unknown sensor type {sensor['type']!r} of {sensor['uid']}")
+    return config
+
+class DeviceRegistry:
+    """The bricklets of one or more brickd hosts as configured, with one shared connection per host.
+
+    Connections reconnect on their own once they were established. Callbacks of all bricklets of a host are
+    dispatched by the single callback thread of its connection.
+    """
+
+    def __init__(self, config, connection_factory=lambda host: IPConnection(), events=None, clock=time.monotonic):
+        self.config = config
+        # sensor values are handled by its dispatcher if set
+        self._events = events
+        self._clock = clock
+        self._connection_factory = connection_factory
+        self._connections = {}
+        # called after every (re)connect of a host, e.g. to configure callbacks again after a brick restarted
+        self._setups = {}
+        # adaptive samplers of the sensors without a fixed period
+        self.samplers = []
+
+    def _connection(self, host):
+        connection = self._connections.get(host)
+        if connection is None:
+            connection = self._connections[host] = self._connection_factory(host)
+            connection.set_auto_reconnect(True)
+            connection.register_callback(IPConnection.CALLBACK_CONNECTED, lambda reason: self._connected(host, reason))
+            self._setups[host] = []
+        return connection
+
+    def uid(self, role):
+        return self.config["devices"][role]["uid"]
+
+    def connection(self, role):
+        """The connection of the host the device with this role is attached to."""
+        return self._connection(self.config["devices"][role]["host"])
+
+    def address(self, role):
+        """(host, port) of the brickd the device with this role is attached to."""
+        host = self.config["hosts"][self.config["devices"][role]["host"]]
+        return (host["host"], host.get("port", 4223))
+
+    def on_connected(self, role, setup):
+        """Calls `setup` on the callback thread whenever the host of the device with this role is (re)connected.
+
+        If the host is connected already, e.g. for a component loaded later, `setup` is also called right away.
+        """
+        host = self.config["devices"][role]["host"]
+        connection = self._connection(host)
+        self._setups[host].append(setup)
+        # appended first, so a connect meanwhile calls it at least once
+        if connection.get_connection_state() == IPConnection.CONNECTION_STATE_CONNECTED:
+            self._setup(host, setup)
+
+    def _setup(self, host, setup):
+        try:
+            setup()
+        except Error as e:
+            print(f"Setting up a device of {host} failed: {e}")
+
+    def add_sensors(self, sensor_data):
+        """Binds the configured sensors to `sensor_data`, the first one of each type to its existing statistics.
+
+        Returns the statistics of all configured sensors.
+        """
+        statistics = []
+        unbound = {kind: getattr(sensor_data, kind) for kind in SENSOR_BRICKLETS}
+        for sensor in self.config.get("sensors", []):
+            kind = sensor["type"]
+            data = unbound.pop(kind, None)
+            if data is None:
+                name = sensor.get("name", sensor["uid"])
+                data = sensor_data.add(Statistics(**{**SENSOR_TYPES[kind], "title": f"{SENSOR_TYPES[kind]['title']} {name}"}))
+            for key in ("critical_min", "critical_max"):
+                if key in sensor:
+                    setattr(data, key, sensor[key])
+            self._bind_sensor(sensor, data)
+            statistics.append(data)
+        return statistics
+
+    def _bind_sensor(self, sensor, data):
+        (bricklet_class, callback, configure, divisor) = SENSOR_BRICKLETS[sensor["type"]]
+        bricklet = bricklet_class(sensor["uid"], self._connection(sensor["host"]))
+
+        if "period" in sensor:
+            period = sensor["period"]
+            bricklet.register_callback(callback, events.callback(self._events, f"sensor {data.title}",
+                                                                 lambda value: data.set_current(value / divisor)))
+            self._setups[sensor["host"]].append(lambda: getattr(bricklet, configure)(period, False, "x", 0, 0))
+            return
+
+        # e.g. "sampling": {"slow_period": 10000, "fast_period": 100, "margin": 5, "calm_time": 60}
+        sensor_type = SENSOR_TYPES[sensor["type"]]
+        options = {"margin": DEFAULT_MARGIN * (sensor_type["max"] - sensor_type["min"]), **sensor.get("sampling", {})}
+        sampler = AdaptiveSampler(data, getattr(bricklet, configure), divisor, baseline_period=DEFAULT_PERIOD, clock=self._clock,
+                                  **options)
+        bricklet.register_callback(callback, events.callback(self._events, f"sensor {data.title}", sampler.on_value))
+        self._setups[sensor["host"]].append(sampler.setup)
+        self.samplers.append(sampler)
+
+    def _connected(self, host, reason):
+        for setup in self._setups[host]:
+            self._setup(host, setup)
+
+    def connect(self):
+        """Connects every host which has devices in use and isn't connected yet.
+
+        Hosts which can't be reached are skipped, so this is called again regularly. Established connections
+        reconnect on their own."""
+        for (name, connection) in self._connections.items():
+            if connection.get_connection_state() != IPConnection.CONNECTION_STATE_DISCONNECTED:
+                continue
+            host = self.config["hosts"][name]
+            try:
+                connection.connect(host["host"], host.get("port", 4223))
+            except (Error, OSError) as e:
+                print(f"Connecting to {name} ({host['host']}) failed: {e}")
+
+    def disconnect(self):
+        for connection in self._connections.values():
+            if connection.get_connection_state() != IPConnection.CONNECTION_STATE_DISCONNECTED:
+                connection.disconnect()
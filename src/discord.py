@@ -1,29 +1,193 @@
 import http.client
 import json
+import threading
+import time
+from urllib.parse import urlsplit
 
-with open("wh.dat") as f:
-    WEBHOOK = f.readline()
+from metrics import METRICS
+from outbox import OUTBOX_PATH, Outbox
 
-@staticmethod
-def send(message):
-    
-    host = "discord.com"
-    connection = http.client.HTTPSConnection(host)
-        
-    global WEBHOOK
-    # your webhook URL
+# the webhook URL is read from the first line of this file when the notifier is created
+WEBHOOK_PATH = "wh.dat"
+
+# discord rejects messages with more than 2000 characters
+MAX_CONTENT_LENGTH = 2000
+
+# first delay in seconds before a failed post is retried, doubled on every further failure
+MIN_BACKOFF = 1
+
+class Notifier:
+    """Sends webhook messages from a worker thread over one persistent connection.
+
+    Messages are stored in a durable outbox first, so `send` never waits for the network and nothing is lost
+    while the webhook is unreachable. The worker replays the outbox in order, joining as many messages as fit into
+    a single POST, and backs off up to `max_backoff` seconds while posts fail. Messages sent within `batch_delay`
+    seconds of each other are joined as well.
+    """
+
+    def __init__(self, webhook, outbox=":memory:", max_messages=10000, batch_delay=0.5, timeout=10, max_backoff=60):
+        url = urlsplit(webhook)
+        self._connection_class = http.client.HTTPSConnection if url.scheme == "https" else http.client.HTTPConnection
+        self._host = url.hostname
+        self._port = url.port
+        self._path = url.path + (f"?{url.query}" if url.query else "")
+        self._timeout = timeout
+        self._connection = None
+
+        self._outbox = Outbox(outbox, max_messages)
+        self._batch_delay = batch_delay
+        self._max_backoff = max_backoff
+        self._thread = threading.Thread(target=self._run, name="notifier", daemon=True)
+        self._closed = False
+        self._stopping = False
+        # notified when messages are stored or removed, and when the worker should stop
+        self._changed = threading.Condition()
+
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+        self.retries = 0
+        self.posts = 0
+
+        METRICS.gauge("discord_outbox_messages", self.pending)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def pending(self):
+        """Number of messages in the outbox, including those left over from an earlier run."""
+        return len(self._outbox)
+
+    def send(self, message):
+        """Stores a message and returns immediately. The oldest message is dropped if the outbox is full."""
+        if self._closed:
+            return
+
+        dropped = self._outbox.append(message)
+        if dropped:
+            self.dropped += dropped
+            METRICS.count("discord_messages", (("result", "dropped"),), dropped)
+        with self._changed:
+            self._changed.notify_all()
+
+    def flush(self, timeout=None):
+        """Blocks until every stored message was posted. Returns False if the timeout expired first."""
+        with self._changed:
+            return self._changed.wait_for(lambda: not len(self._outbox), timeout)
 
-    payload = json.dumps({"content": message})
+    def close(self, timeout=5):
+        """Flushes the outbox and stops the worker, waiting at most `timeout` seconds.
 
-    headers = {
-        "Content-Type": "application/json"
-    }
+        Messages which could not be posted in time stay in the outbox and are sent after the next start.
+        """
+        if self._closed:
+            return
+        self._closed = True
 
-    connection.request("POST", WEBHOOK, body=payload, headers=headers)
+        deadline = time.monotonic() + timeout
+        if self._thread.is_alive():
+            self.flush(timeout)
+            with self._changed:
+                self._stopping = True
+                self._changed.notify_all()
+            self._thread.join(max(0, deadline - time.monotonic()))
 
-    # get the response
-    response = connection.getresponse()
-    result = response.read()
+        if not self._thread.is_alive():
+            if self._connection is not None:
+                self._connection.close()
+            self._outbox.close()
+
+    def _run(self):
+        backoff = 0
+        while True:
+            with self._changed:
+                idle = not len(self._outbox)
+                self._changed.wait_for(lambda: self._stopping or len(self._outbox))
+                # wait out the backoff, or collect what arrives shortly after the first message
+                delay = backoff or (self._batch_delay if idle else 0)
+                if delay:
+                    self._changed.wait_for(lambda: self._stopping, delay)
+                if self._stopping:
+                    return
+
+            batch = self._outbox.peek(MAX_CONTENT_LENGTH)
+            if not batch:
+                continue
+
+            try:
+                with METRICS.time("discord_post_seconds"):
+                    self._post("\n".join(content for (_, content) in batch)[:MAX_CONTENT_LENGTH])
+                self.sent += len(batch)
+                METRICS.count("discord_messages", (("result", "sent"),), len(batch))
+            except _Rejected as e:
+                # retrying a request discord refused won't help, so drop it rather than block the outbox
+                print(f"Discord notification rejected: {e}")
+                self.failed += len(batch)
+                METRICS.count("discord_messages", (("result", "failed"),), len(batch))
+            except (OSError, http.client.HTTPException) as e:
+                backoff = min(max(backoff * 2, MIN_BACKOFF), self._max_backoff)
+                print(f"Discord notification failed, retrying in {backoff}s: {e}")
+                self.retries += 1
+                METRICS.count("discord_retries")
+                continue
+
+            backoff = 0
+            self._outbox.remove(batch)
+            with self._changed:
+                self._changed.notify_all()
+
+    def _post(self, content):
+        payload = json.dumps({"content": content})
+        headers = {
+            "Content-Type": "application/json"
+        }
+
+        # a kept-alive connection may have been closed by the server, so retry once on a fresh one
+        for attempt in range(2):
+            if self._connection is None:
+                self._connection = self._connection_class(self._host, self._port, timeout=self._timeout)
+            try:
+                self._connection.request("POST", self._path, body=payload, headers=headers)
+                response = self._connection.getresponse()
+                result = response.read()
+                break
+            except (OSError, http.client.HTTPException):
+                self._connection.close()
+                self._connection = None
+                if attempt:
+                    raise
+
+        self.posts += 1
+        message = f"{response.status} {response.reason}" + (f"\n{result.decode()}" if result else "")
+        # rate limits and server errors pass, anything else is wrong with the request itself
+        if response.status == 429 or response.status >= 500:
+            raise http.client.HTTPException(message)
+        if response.status >= 400:
+            raise _Rejected(message)
+
+        return message
+
+class _Rejected(Exception):
+    pass
+
+_notifier = None
+
+def read_webhook(path=WEBHOOK_PATH):
+    with open(path) as f:
+        return f.readline().strip()
+
+def get_notifier():
+    global _notifier
+    if _notifier is None:
+        _notifier = Notifier(read_webhook(), OUTBOX_PATH).start()
+    return _notifier
+
+def send(message):
+    """Stores a message for the discord webhook without waiting for the request."""
+    get_notifier().send(message)
 
-    # return back to the calling function with the result
-    return f"{response.status} {response.reason}\n{result.decode()}"
+def close(timeout=5):
+    """Sends all stored messages, waiting at most `timeout` seconds. The rest is sent after the next start."""
+    if _notifier is not None:
+        _notifier.close(timeout)
@@ -1,125 +1,41 @@
 import os
 from random import choice
-from time import sleep
+from time import perf_counter, process_time, sleep
 
 from tinkerforge.bricklet_dual_button_v2 import BrickletDualButtonV2
 from tinkerforge.bricklet_lcd_128x64 import BrickletLCD128x64
 from tinkerforge.bricklet_rgb_led_button import BrickletRGBLEDButton
-from tinkerforge.ip_connection import IPConnection
+from tinkerforge.ip_connection import Error
 import vizdoom as vzd
 import numpy as np
-import cv2
 
-from PIL import Image
+from devices import DeviceRegistry, load_config
+from frame_pipeline import FramePipeline, scale_and_dither
+from frame_transport import FrameTransport
+from metrics import Histogram
 
-def scale_and_dither(image_array, depth_array, new_size=(128, 64), depth_intensity=-0.5, depth_boost=1):
-    """Transforms an RGB image by enhancing red/blue saturation, adjusting contrast based on depth, resizing, and dithering to black & white."""
-
-    def adjust_depth_based_on_color(image, depth_buffer, boost_factor=10):
-        """Modifies the depth buffer to make strongly red/blue objects appear closer."""
-
-        # Convert image to HSV for better color detection
-        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-        h, s, v = cv2.split(hsv)
-
-        # Identify strong red & blue regions
-        blue_mask = ((h > 110) & (h < 125)).astype(np.uint8)
-        color_mask =  blue_mask
-
-        # Reduce depth values where red/blue objects are detected (make them "closer")
-        adjusted_depth = depth_buffer - (color_mask * boost_factor * depth_buffer.max())
-        adjusted_depth = np.clip(adjusted_depth, depth_buffer.min(), depth_buffer.max())
-
-        return adjusted_depth
-
-    # 1. Enhance red and blue saturation
-    def enhance_red_blue(image):
-        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-        h, s, v = cv2.split(hsv)
-
-        # Detect strong red & blue areas
-        red_mask = ((h < 10) | (h > 170)).astype(np.uint8)
-        blue_mask = ((h > 100) & (h < 130)).astype(np.uint8)
-        color_mask = red_mask | blue_mask
-
-        # Boost saturation **and brightness**
-        s = cv2.subtract(s, (red_mask * 10).astype(np.uint8))  # Increase saturation
-        v = cv2.subtract(v, (red_mask * 8).astype(np.uint8))  # Boost brightness
-
-        boosted_hsv = cv2.merge([h, s, v])
-        return cv2.cvtColor(boosted_hsv, cv2.COLOR_HSV2BGR)
-
-    depth_array = adjust_depth_based_on_color(image_array, depth_array)
-
-    # 2. Normalize depth values for contrast adjustments
-    depth_array = depth_array.astype(np.float32)
-    depth_array = (depth_array - depth_array.min()) / (depth_array.max() - depth_array.min())
-
-    # Match depth array shape with image_array
-    depth_array_3ch = np.repeat(depth_array[:, :, np.newaxis], 3, axis=2)
-
-    # Adjust brightness: closer objects are brighter, farther objects are darker
-    adjusted_img = image_array.astype(np.float32) + (255 * depth_intensity * depth_array_3ch)
-    adjusted_img = np.clip(adjusted_img, 0, 255).astype(np.uint8)
-
-    boosted = enhance_red_blue(adjusted_img)
-    # 3. Convert to grayscale, emphasizing closer objects
-    gray_img = cv2.cvtColor(boosted, cv2.COLOR_BGR2GRAY)
-
-    # Enhance contrast based on depth (boosting closer objects)
-    enhanced_gray = cv2.addWeighted(gray_img, 1.0 + depth_boost, (depth_array * 255).astype(np.uint8), -depth_boost, 0)
-
-    # Resize
-    resized_img = cv2.resize(enhanced_gray, new_size, interpolation=cv2.INTER_LANCZOS4)
-
-    # 4. Apply dithering to create binary (black & white) image
-    image_pil = Image.fromarray(resized_img).convert("L")
-    dithered_img = image_pil.convert("1", dither=Image.Dither.FLOYDSTEINBERG)
-
-    return np.array(dithered_img, dtype=bool)  # Convert to boolean array
-
-
-IP = "172.20.10.242"
-PORT = 4223
-
-def main(conn):
-    #          FWD    LEFT   RIGHT  FIRE
-    actions = [False, False, False, False]
-    lcd = BrickletLCD128x64("24Rh", conn);
-    fire_button = BrickletRGBLEDButton("23Qx", conn)
-    dual_button = BrickletDualButtonV2("Vd8", conn)
-
-    def motion_callback(left, right, _left_led, _right_led):
-        actions[1] = left == BrickletDualButtonV2.BUTTON_STATE_PRESSED
-        actions[2] = right == BrickletDualButtonV2.BUTTON_STATE_PRESSED
-
-
-    def fire_callback(state):
-        print(state)
-        actions[3] = state == fire_button.BUTTON_STATE_PRESSED
-
-    conn.connect(IP, PORT)
-
-    fire_button.register_callback(fire_button.CALLBACK_BUTTON_STATE_CHANGED, fire_callback)
-    dual_button.register_callback(dual_button.CALLBACK_STATE_CHANGED, motion_callback)
-    dual_button.set_state_changed_callback_configuration(True)
-    print(dual_button.get_led_state())
+# every n-th game tick is fetched and converted for the LCD, the transport drops frames the link can't keep up with
+DISPLAY_INTERVAL_TICKS = 2
+# smallest 4:3 resolution that scales down to the 128x64 LCD by whole pixels (2x3)
+SCREEN_RESOLUTION = vzd.ScreenResolution.RES_256X192
 
+def create_game(window_visible=True):
     game = vzd.DoomGame()
 
 
     game.set_doom_scenario_path(os.path.join(vzd.scenarios_path, "basic.wad"))
     game.set_doom_map("map01")
-    game.set_screen_resolution(vzd.ScreenResolution.RES_640X480)
+    game.set_screen_resolution(SCREEN_RESOLUTION)
     game.set_screen_format(vzd.ScreenFormat.RGB24)
 
+    # only the screen and depth buffers are shown on the LCD
     game.set_depth_buffer_enabled(True)
-    game.set_labels_buffer_enabled(True)
-    game.set_automap_buffer_enabled(True)
+    game.set_labels_buffer_enabled(False)
+    game.set_automap_buffer_enabled(False)
 
-    game.set_objects_info_enabled(True)
+    game.set_objects_info_enabled(False)
 
-    game.set_sectors_info_enabled(True)
+    game.set_sectors_info_enabled(False)
 
     game.set_render_hud(False)
     game.set_render_minimal_hud(False)
@@ -156,7 +72,7 @@ def main(conn):
     game.set_episode_start_time(10)
 
     # Makes the window appear (turned on by default)
-    game.set_window_visible(True)
+    game.set_window_visible(window_visible)
 
     # Turns on the sound. (turned off by default)
     # game.set_sound_enabled(True)
@@ -181,6 +97,58 @@ def main(conn):
     # Initialize the game. Further configuration won't take any effect from now on.
     game.init()
 
+    return game
+
+def record_frames(path, count=300):
+    """Records screen and depth buffers of a game with random actions, e.g. for benchmarks."""
+    game = create_game(window_visible=False)
+    screens = []
+    depths = []
+
+    while len(screens) < count:
+        game.new_episode()
+        while not game.is_episode_finished() and len(screens) < count:
+            state = game.get_state()
+            screens.append(state.screen_buffer)
+            depths.append(state.depth_buffer)
+            game.make_action([choice([True, False]) for _ in range(4)])
+
+    game.close()
+    np.savez_compressed(path, screens=np.array(screens), depths=np.array(depths))
+
+def main(registry, control=None):
+    #          FWD    LEFT   RIGHT  FIRE
+    actions = [False, False, False, False]
+    lcd = BrickletLCD128x64(registry.uid("lcd"), registry.connection("lcd"))
+    fire_button = BrickletRGBLEDButton(registry.uid("button"), registry.connection("button"))
+    dual_button = BrickletDualButtonV2(registry.uid("dual_button"), registry.connection("dual_button"))
+
+    def motion_callback(left, right, _left_led, _right_led):
+        actions[1] = left == BrickletDualButtonV2.BUTTON_STATE_PRESSED
+        actions[2] = right == BrickletDualButtonV2.BUTTON_STATE_PRESSED
+
+
+    def fire_callback(state):
+        print(state)
+        actions[3] = state == fire_button.BUTTON_STATE_PRESSED
+
+    registry.connect()
+
+    # the game takes over the LCD from the monitoring program, whose tabs and graph would stay over the frames;
+    # the program draws them again once the game ended
+    try:
+        lcd.remove_all_gui()
+        lcd.clear_display()
+    except Error as e:
+        print(f"Clearing the LCD failed: {e}")
+
+    fire_button.register_callback(fire_button.CALLBACK_BUTTON_STATE_CHANGED, fire_callback)
+    dual_button.register_callback(dual_button.CALLBACK_STATE_CHANGED, motion_callback)
+    dual_button.set_state_changed_callback_configuration(True)
+    print(dual_button.get_led_state())
+
+    game = create_game()
+
     # Define some actions. Each list entry corresponds to declared buttons:
     # MOVE_LEFT, MOVE_RIGHT, ATTACK
     # game.get_available_buttons_size() can be used to check the number of available buttons.
@@ -193,46 +161,41 @@ def main(conn):
     # Without this everything would go too fast for you to keep track of what's happening.
     sleep_time = 1.0 / vzd.DEFAULT_TICRATE  # = 0.028
 
+    pipeline = FramePipeline()
+    transport = FrameTransport(lcd).start()
+    # seconds to convert a frame for the LCD, reported to the supervisor
+    conversion = Histogram()
+
+    stopped = False
     for i in range(episodes):
+        if stopped:
+            break
         print(f"Episode #{i + 1}")
 
         # Starts a new episode. It is not needed right after init() but it doesn't cost much. At least the loop is nicer.
         game.new_episode()
 
         tick = 0
+        cpu_start = process_time()
         while not game.is_episode_finished():
-
-            # Gets the state
-            state = game.get_state()
-
-            # Which consists of:
-            n = state.number
-            vars = state.game_variables
-
-            # Different buffers (screens, depth, labels, automap, audio)
-            # Expect of screen buffer some may be None if not first enabled.
-            screen_buf = state.screen_buffer
-            depth_buf = state.depth_buffer
-            labels_buf = state.labels_buffer
-            automap_buf = state.automap_buffer
-            audio_buf = state.audio_buffer
-
-            # List of labeled objects visible in the frame, may be None if not first enabled.
-            labels = state.labels
-
-            # List of all objects (enemies, pickups, etc.) present in the current episode, may be None if not first enabled
-            objects = state.objects
-
-            # List of all sectors (map geometry), may be None if not first enabled.
-            sectors = state.sectors
-
-            black_white = scale_and_dither(state.screen_buffer, state.depth_buffer)
-
-            black_white_flat = [bool(pixel) for lines in black_white for pixel in lines]
-            # print(black_white_flat)
-            if tick % 30 == 0:
-                lcd.write_pixels(0, 0, 127, 63, black_white_flat)
+            # the supervisor asked to end the game
+            if control is not None and control.poll() and control.recv() == "stop":
+                stopped = True
+                break
+
+            # Fetch and convert only the frames which are shown
+            if tick % DISPLAY_INTERVAL_TICKS == 0:
+                state = game.get_state()
+
+                before = perf_counter()
+                black_white = pipeline.process(state.screen_buffer, state.depth_buffer)
+                conversion.observe(perf_counter() - before)
+                transport.submit(black_white)
             tick += 1
+
+            # report about once per game second
+            if control is not None and tick % vzd.DEFAULT_TICRATE == 0:
+                control.send(("stats", {**transport.stats(), "conversion": conversion}))
             # Games variables can be also accessed via
             # (including the ones that were not added as available to a game state):
             # game.get_game_variable(GameVariable.AMMO2)
@@ -254,15 +217,23 @@ def main(conn):
 
         # Check how the episode went.
         print("Episode finished.")
+        game_seconds = max(tick, 1) / vzd.DEFAULT_TICRATE
+        print(f"CPU per game second (this process): {(process_time() - cpu_start) / game_seconds * 1000:.1f} ms")
         print("Total reward:", game.get_total_reward())
+        print("LCD frames:", transport.stats())
         print("************************")
 
+    transport.close()
+    if control is not None:
+        control.send(("stats", {**transport.stats(), "conversion": conversion}))
+
     # It will be done automatically anyway but sometimes you need to do it in the middle of the program...
     game.close()
 
-def doom_main():
-    conn = IPConnection()
+def doom_main(control=None, config=None):
+    """Runs a game with its own connections, `control` is an optional pipe to the supervisor."""
+    registry = DeviceRegistry(config or load_config())
     try:
-        main(conn)
+        main(registry, control)
     finally:
-        conn.disconnect()
+        registry.disconnect()
@@ -0,0 +1,75 @@
+import multiprocessing
+
+from metrics import METRICS
+
+def _run_doom(control, config):
+    """Entry point of the game process, Doom and its dependencies are only loaded here."""
+    from doom import doom_main
+
+    doom_main(control, config)
+
+class DoomSupervisor:
+    """Runs Doom in a child process with its own brickd connection, controlled through a pipe."""
+
+    def __init__(self, config):
+        # device config of the game, see devices.load_config
+        self._config = config
+        # a fresh interpreter instead of a fork, which would copy the IPConnection threads
+        self._context = multiprocessing.get_context("spawn")
+        self._process = None
+        self._control = None
+
+        # frame statistics sent by the running or last game
+        self.last_stats = None
+
+    def is_running(self):
+        return self._process is not None and self._process.is_alive()
+
+    def start(self):
+        """Starts a game unless one is running or the end of the last one wasn't reported by `poll` yet."""
+        if self._process is not None:
+            return False
+
+        (self._control, child_control) = self._context.Pipe()
+        self._process = self._context.Process(target=_run_doom, args=(child_control, self._config), name="doom", daemon=True)
+        self._process.start()
+        child_control.close()
+        return True
+
+    def stop(self, timeout=5):
+        """Asks the game to end and kills it if it doesn't within `timeout` seconds, `poll` reports the end."""
+        if self._process is None:
+            return
+
+        if self._process.is_alive():
+            try:
+                self._control.send("stop")
+            except OSError:
+                pass
+            self._process.join(timeout)
+            if self._process.is_alive():
+                self._process.terminate()
+                self._process.join()
+
+    def poll(self):
+        """Receives messages from the game. Returns True once if the game has ended since the last call."""
+        if self._process is None:
+            return False
+
+        try:
+            while self._control.poll():
+                (kind, value) = self._control.recv()
+                if kind == "stats":
+                    METRICS.set_histogram("doom_frame_conversion_seconds", value.pop("conversion"))
+                    self.last_stats = value
+        except (EOFError, OSError):
+            pass
+
+        if self._process.is_alive():
+            return False
+
+        self._process.join()
+        self._control.close()
+        self._process = None
+        self._control = None
+        return True
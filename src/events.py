@@ -0,0 +1,103 @@
+import collections
+import heapq
+import itertools
+import threading
+import time
+
+from metrics import METRICS
+
+class EventBus:
+    """Runs the handlers of bricklet callbacks on one dispatcher thread instead of the callback threads.
+
+    A callback only appends the event with its time stamp to a deque, which needs no lock, and returns. The
+    dispatcher holds events back for `reorder_delay` seconds, so events of different connections are handled in
+    the order they arrived, and calls their handlers one after another. Handlers therefore never race each other
+    and may make requests to bricklets. An event which repeats within the `coalesce` time of its handler is
+    dropped, e.g. motion detected again while the first detection is still handled.
+    """
+
+    def __init__(self, reorder_delay=0.002, clock=time.monotonic):
+        self.reorder_delay = reorder_delay
+        self._clock = clock
+        self._queue = collections.deque()
+        self._sequence = itertools.count()
+        self._wakeup = threading.Event()
+        # (handler, coalesce time) by event name
+        self._handlers = {}
+        # time stamp of the last handled event by name, for coalescing
+        self._handled = {}
+        # (time stamp, sequence, name, arguments) of the events held back for reordering
+        self._pending = []
+        self._thread = threading.Thread(target=self._run, name="events", daemon=True)
+
+        self.dispatched = 0
+        self.coalesced = 0
+
+        METRICS.gauge("event_queue_depth", lambda: len(self._queue))
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def callback(self, name, handler, coalesce=0):
+        """Registers `handler` for the event `name` and returns the function to register as bricklet callback."""
+        self._handlers[name] = (handler, coalesce)
+        return lambda *args: self.publish(name, *args)
+
+    def publish(self, name, *args):
+        # runs on a callback thread, keep it short
+        self._queue.append((self._clock(), next(self._sequence), name, args))
+        if not self._wakeup.is_set():
+            self._wakeup.set()
+
+    def step(self):
+        """Handles the events which are due, returns the clock time when the next one is due or None.
+
+        Called by the dispatcher thread, or directly instead of starting it, e.g. with a simulated clock.
+        """
+        (queue, pending) = (self._queue, self._pending)
+        while queue:
+            heapq.heappush(pending, queue.popleft())
+
+        now = self._clock()
+        # the same sum as returned below, so setting a simulated clock to the returned time handles the event
+        while pending and pending[0][0] + self.reorder_delay <= now:
+            (timestamp, _, name, args) = heapq.heappop(pending)
+            self._dispatch(timestamp, name, args)
+
+        return pending[0][0] + self.reorder_delay if pending else None
+
+    def _run(self):
+        timeout = None
+        while True:
+            self._wakeup.wait(timeout)
+            # cleared before the queue is emptied, so an event appended meanwhile sets it again
+            self._wakeup.clear()
+            due = self.step()
+            timeout = None if due is None else max(0, due - self._clock())
+
+    def _dispatch(self, timestamp, name, args):
+        (handler, coalesce) = self._handlers[name]
+        if coalesce:
+            last = self._handled.get(name)
+            if last is not None and timestamp - last < coalesce:
+                self.coalesced += 1
+                METRICS.count("events", (("event", name), ("result", "coalesced")))
+                return
+            self._handled[name] = timestamp
+
+        with METRICS.time("event_seconds", (("event", name),)):
+            try:
+                handler(*args)
+            except Exception as e:
+                # one failing handler must not stop the dispatcher of all others
+                print(f"Handling {name} failed: {e!r}")
+        self.dispatched += 1
+        METRICS.count("events", (("event", name), ("result", "handled")))
+        METRICS.observe("event_latency_seconds", self._clock() - timestamp)
+
+def callback(events, name, handler, coalesce=0):
+    """The bricklet callback for `handler`: through the event bus if there is one, otherwise `handler` itself."""
+    if events is None:
+        return handler
+    return events.callback(name, handler, coalesce)
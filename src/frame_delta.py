@@ -0,0 +1,71 @@
+import numpy as np
+
+# write_pixels is split into packets of 448 pixels, each with an 8 byte header and 64 bytes of payload
+PIXELS_PER_PACKET = 448
+BYTES_PER_PACKET = 72
+
+def window_cost(x_start, y_start, x_end, y_end):
+    """Bytes sent on the bus to write the given window."""
+    pixels = (x_end - x_start + 1) * (y_end - y_start + 1)
+    return -(-pixels // PIXELS_PER_PACKET) * BYTES_PER_PACKET
+
+class DeltaEncoder:
+    """Finds the cheapest set of `write_pixels` windows that updates the last sent frame to a new one."""
+
+    def __init__(self, width=128, height=64):
+        self.width = width
+        self.height = height
+        self.full_cost = window_cost(0, 0, width - 1, height - 1)
+        # last frame, packed to 8 pixels per byte
+        self._last = None
+
+    def reset(self):
+        """Forgets the last frame, e.g. after something else drew on the display."""
+        self._last = None
+
+    def encode(self, black_white):
+        """Returns the windows (x_start, y_start, x_end, y_end) to write and remembers the frame as sent.
+
+        If writing the windows fails, the caller has to `reset` the encoder, so the next frame is sent in full
+        instead of as a delta to pixels that were never drawn.
+        """
+        packed = np.packbits(black_white, axis=1)
+        last = self._last
+        self._last = packed
+
+        full = [(0, 0, self.width - 1, self.height - 1)]
+        if last is None:
+            return full
+
+        difference = packed ^ last
+        changed_rows = np.flatnonzero(difference.any(axis=1))
+        if len(changed_rows) == 0:
+            return []
+
+        # consecutive changed rows form spans
+        breaks = np.flatnonzero(np.diff(changed_rows) > 1)
+        starts = np.concatenate(([changed_rows[0]], changed_rows[breaks + 1]))
+        ends = np.concatenate((changed_rows[breaks], [changed_rows[-1]]))
+
+        windows = []
+        for (y_start, y_end) in zip(starts.tolist(), ends.tolist()):
+            window = self._window(difference, y_start, y_end)
+
+            # merge with the previous window if one window is cheaper than two
+            if windows:
+                previous = windows[-1]
+                merged = self._window(difference, previous[1], y_end)
+                if window_cost(*merged) <= window_cost(*previous) + window_cost(*window):
+                    windows[-1] = merged
+                    continue
+            windows.append(window)
+
+        if sum(window_cost(*window) for window in windows) >= self.full_cost:
+            return full
+        return windows
+
+    def _window(self, difference, y_start, y_end):
+        changed_bytes = np.flatnonzero(difference[y_start:y_end + 1].any(axis=0))
+        x_start = int(changed_bytes[0]) * 8
+        x_end = min(self.width - 1, int(changed_bytes[-1]) * 8 + 7)
+        return (x_start, y_start, x_end, y_end)
@@ -0,0 +1,175 @@
+import numpy as np
+import cv2
+
+from PIL import Image
+
+def scale_and_dither(image_array, depth_array, new_size=(128, 64), depth_intensity=-0.5, depth_boost=1):
+    """Transforms an RGB image by enhancing red/blue saturation, adjusting contrast based on depth, resizing, and dithering to black & white."""
+
+    def adjust_depth_based_on_color(image, depth_buffer, boost_factor=10):
+        """Modifies the depth buffer to make strongly red/blue objects appear closer."""
+
+        # Convert image to HSV for better color detection
+        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+        h, s, v = cv2.split(hsv)
+
+        # Identify strong red & blue regions
+        blue_mask = ((h > 110) & (h < 125)).astype(np.uint8)
+        color_mask =  blue_mask
+
+        # Reduce depth values where red/blue objects are detected (make them "closer"), in int32 since uint8 wraps around
+        adjusted_depth = depth_buffer.astype(np.int32) - (color_mask.astype(np.int32) * boost_factor * int(depth_buffer.max()))
+        adjusted_depth = np.clip(adjusted_depth, depth_buffer.min(), depth_buffer.max())
+
+        return adjusted_depth
+
+    # 1. Enhance red and blue saturation
+    def enhance_red_blue(image):
+        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+        h, s, v = cv2.split(hsv)
+
+        # Detect strong red & blue areas
+        red_mask = ((h < 10) | (h > 170)).astype(np.uint8)
+        blue_mask = ((h > 100) & (h < 130)).astype(np.uint8)
+        color_mask = red_mask | blue_mask
+
+        # Boost saturation **and brightness**
+        s = cv2.subtract(s, (red_mask * 10).astype(np.uint8))  # Increase saturation
+        v = cv2.subtract(v, (red_mask * 8).astype(np.uint8))  # Boost brightness
+
+        boosted_hsv = cv2.merge([h, s, v])
+        return cv2.cvtColor(boosted_hsv, cv2.COLOR_HSV2BGR)
+
+    depth_array = adjust_depth_based_on_color(image_array, depth_array)
+
+    # 2. Normalize depth values for contrast adjustments
+    depth_array = depth_array.astype(np.float32)
+    depth_array = (depth_array - depth_array.min()) / (depth_array.max() - depth_array.min())
+
+    # Match depth array shape with image_array
+    depth_array_3ch = np.repeat(depth_array[:, :, np.newaxis], 3, axis=2)
+
+    # Adjust brightness: closer objects are brighter, farther objects are darker
+    adjusted_img = image_array.astype(np.float32) + (255 * depth_intensity * depth_array_3ch)
+    adjusted_img = np.clip(adjusted_img, 0, 255).astype(np.uint8)
+
+    boosted = enhance_red_blue(adjusted_img)
+    # 3. Convert to grayscale, emphasizing closer objects
+    gray_img = cv2.cvtColor(boosted, cv2.COLOR_BGR2GRAY)
+
+    # Enhance contrast based on depth (boosting closer objects)
+    enhanced_gray = cv2.addWeighted(gray_img, 1.0 + depth_boost, (depth_array * 255).astype(np.uint8), -depth_boost, 0)
+
+    # Resize
+    resized_img = cv2.resize(enhanced_gray, new_size, interpolation=cv2.INTER_LANCZOS4)
+
+    # 4. Apply dithering to create binary (black & white) image
+    image_pil = Image.fromarray(resized_img).convert("L")
+    dithered_img = image_pil.convert("1", dither=Image.Dither.FLOYDSTEINBERG)
+
+    return np.array(dithered_img, dtype=bool)  # Convert to boolean array
+
+BAYER_8X8 = np.array([
+    [ 0, 32,  8, 40,  2, 34, 10, 42],
+    [48, 16, 56, 24, 50, 18, 58, 26],
+    [12, 44,  4, 36, 14, 46,  6, 38],
+    [60, 28, 52, 20, 62, 30, 54, 22],
+    [ 3, 35, 11, 43,  1, 33,  9, 41],
+    [51, 19, 59, 27, 49, 17, 57, 25],
+    [15, 47,  7, 39, 13, 45,  5, 37],
+    [63, 31, 55, 23, 61, 29, 53, 21],
+])
+
+class FramePipeline:
+    """Fast version of `scale_and_dither`.
+
+    The frame is downsampled first, converted to HSV once and processed in preallocated buffers, so a frame
+    allocates (almost) nothing. `dither` is either "bayer" (ordered, vectorised) or "floyd-steinberg".
+    """
+
+    def __init__(self, new_size=(128, 64), depth_intensity=-0.5, depth_boost=1, dither="bayer"):
+        if dither not in ("bayer", "floyd-steinberg"):
+            raise ValueError(f"unknown dithering {dither}")
+
+        self.new_size = new_size
+        self.depth_intensity = depth_intensity
+        self.depth_boost = depth_boost
+        self.dither = dither
+
+        (width, height) = new_size
+        self._image = np.empty((height, width, 3), np.uint8)
+        self._hsv = np.empty((height, width, 3), np.uint8)
+        self._gray = np.empty((height, width), np.uint8)
+        self._depth = np.empty((height, width), np.uint8)
+        self._depth_normalized = np.empty((height, width), np.uint8)
+        self._mask = np.empty((height, width), bool)
+        self._value = np.empty((height, width), np.float32)
+        self._depth_value = np.empty((height, width), np.float32)
+        self._output = np.empty((height, width), bool)
+
+        # hue (0..179) lookup tables for the colours the reference function detects
+        hue = np.arange(256)
+        self._blue_lut = (hue > 110) & (hue < 125)
+        self._red_lut = (hue < 10) | (hue > 170)
+
+        # maps a depth value to 0..255 for the depth range of the current frame
+        self._ramp = np.arange(256, dtype=np.float32)
+        self._depth_lut_float = np.empty(256, np.float32)
+        self._depth_lut = np.empty(256, np.uint8)
+
+        repeats = (height // 8 + 1, width // 8 + 1)
+        self._threshold = ((np.tile(BAYER_8X8, repeats)[:height, :width] + 0.5) * (256 / 64)).astype(np.float32)
+
+    def process(self, image_array, depth_array):
+        """Returns the dithered frame as boolean array. It is overwritten by the next call."""
+        cv2.resize(image_array, self.new_size, dst=self._image, interpolation=cv2.INTER_AREA)
+        cv2.resize(depth_array, self.new_size, dst=self._depth, interpolation=cv2.INTER_AREA)
+
+        # one HSV conversion for both colour masks, the depth based brightness shift barely changes the hue
+        cv2.cvtColor(self._image, cv2.COLOR_BGR2HSV, dst=self._hsv)
+        hue = self._hsv[:, :, 0]
+
+        # blue objects appear at the nearest depth
+        depth_min = int(self._depth.min())
+        depth_max = int(self._depth.max())
+        np.take(self._blue_lut, hue, out=self._mask)
+        np.copyto(self._depth, depth_min, where=self._mask)
+
+        lut = self._depth_lut_float
+        np.subtract(self._ramp, depth_min, out=lut)
+        np.multiply(lut, 255 / ((depth_max - depth_min) or 1), out=lut)
+        np.clip(lut, 0, 255, out=lut)
+        np.copyto(self._depth_lut, lut, casting="unsafe")
+        cv2.LUT(self._depth, self._depth_lut, dst=self._depth_normalized)
+
+        value = self._value
+        depth_value = self._depth_value
+        np.copyto(depth_value, self._depth_normalized)
+
+        # closer objects are brighter, farther objects are darker
+        cv2.cvtColor(self._image, cv2.COLOR_BGR2GRAY, dst=self._gray)
+        np.copyto(value, self._gray)
+        value += depth_value * self.depth_intensity
+        np.clip(value, 0, 255, out=value)
+
+        # red objects are darkened slightly
+        np.take(self._red_lut, hue, out=self._mask)
+        np.subtract(value, 8, out=value, where=self._mask)
+
+        # enhance contrast based on depth
+        value *= 1.0 + self.depth_boost
+        value -= depth_value * self.depth_boost
+        np.clip(value, 0, 255, out=value)
+
+        if self.dither == "bayer":
+            np.greater(value, self._threshold, out=self._output)
+        else:
+            self._error_diffusion(value)
+
+        return self._output
+
+    def _error_diffusion(self, value):
+        """Floyd–Steinberg dithering by PIL, as `scale_and_dither` does it."""
+        np.copyto(self._gray, value, casting="unsafe")
+        dithered = Image.fromarray(self._gray).convert("1", dither=Image.Dither.FLOYDSTEINBERG)
+        np.copyto(self._output, np.asarray(dithered, dtype=bool))
@@ -0,0 +1,121 @@
+import threading
+import time
+from collections import deque
+from statistics import mean, quantiles
+
+import numpy as np
+from tinkerforge.ip_connection import Error
+
+from frame_delta import DeltaEncoder, window_cost
+
+class LatestFrameSlot:
+    """Holds at most one frame, a new frame replaces one that was not taken yet."""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._frame = None
+        self._closed = False
+
+    def put(self, frame):
+        """Stores the frame. Returns True if an older frame was dropped."""
+        with self._condition:
+            dropped = self._frame is not None
+            self._frame = frame
+            self._condition.notify()
+            return dropped
+
+    def take(self):
+        """Waits for a frame. Returns None once the slot is closed."""
+        with self._condition:
+            self._condition.wait_for(lambda: self._frame is not None or self._closed)
+            (frame, self._frame) = (self._frame, None)
+            return frame
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+
+class FrameTransport:
+    """Writes frames to the LCD on its own thread, so the game loop never waits for the bus.
+
+    Frames are handed over bit-packed, stale frames are dropped if the link can't keep up.
+    """
+
+    def __init__(self, lcd, width=128, height=64):
+        self._lcd = lcd
+        self._width = width
+        self._height = height
+        self._slot = LatestFrameSlot()
+        self._encoder = DeltaEncoder(width, height)
+        self._thread = threading.Thread(target=self._run, name="frame-transport", daemon=True)
+
+        self.produced = 0
+        self.sent = 0
+        self.dropped = 0
+        # frames which could not be written, e.g. after a timeout
+        self.failed = 0
+        # frames which were identical to the last sent one
+        self.unchanged = 0
+        self.windows = 0
+        self.bytes_sent = 0
+        # seconds from submitting a frame until it was written to the LCD
+        self._latencies = deque(maxlen=1000)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def submit(self, black_white):
+        packed = np.packbits(black_white, axis=None)
+        self.produced += 1
+        if self._slot.put((packed, time.perf_counter())):
+            self.dropped += 1
+
+    def _run(self):
+        pixel_count = self._width * self._height
+        while (frame := self._slot.take()) is not None:
+            (packed, submitted) = frame
+            black_white = np.unpackbits(packed, count=pixel_count).astype(bool).reshape(self._height, self._width)
+
+            # only write the parts of the frame that changed
+            windows = self._encoder.encode(black_white)
+            try:
+                for (x_start, y_start, x_end, y_end) in windows:
+                    pixels = black_white[y_start:y_end + 1, x_start:x_end + 1].ravel().tolist()
+                    self._lcd.write_pixels(x_start, y_start, x_end, y_end, pixels)
+                    self.bytes_sent += window_cost(x_start, y_start, x_end, y_end)
+            except Error as e:
+                # a lost frame must not end the thread, the next one may get through again; it is written in
+                # full, since it is unknown which windows of this one reached the display
+                self._encoder.reset()
+                self.failed += 1
+                if self.failed == 1:
+                    print(f"Writing a frame to the LCD failed: {e}")
+                continue
+
+            self.windows += len(windows)
+            if not windows:
+                self.unchanged += 1
+            self.sent += 1
+            self._latencies.append(time.perf_counter() - submitted)
+
+    def close(self, timeout=1):
+        self._slot.close()
+        self._thread.join(timeout)
+
+    def stats(self):
+        latencies = list(self._latencies)
+        stats = {
+            "produced": self.produced,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "unchanged": self.unchanged,
+            "windows": self.windows,
+            "bytes_per_frame": self.bytes_sent / (self.sent or 1),
+        }
+        if len(latencies) >= 2:
+            stats["latency_ms"] = mean(latencies) * 1000
+            stats["latency_p95_ms"] = quantiles(latencies, n=20)[18] * 1000
+        return stats
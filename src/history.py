@@ -0,0 +1,66 @@
+from array import array
+
+class RingBuffer:
+    """Fixed-capacity circular buffer of floats, preallocated in an `array`."""
+
+    def __init__(self, capacity):
+        self._data = array("d", bytes(8 * capacity))
+        self._capacity = capacity
+        # index where the next value is written
+        self._end = 0
+        self._size = 0
+
+    def append(self, value):
+        self._data[self._end] = value
+        self._end = (self._end + 1) % self._capacity
+        if self._size < self._capacity:
+            self._size += 1
+
+    def extend(self, values):
+        for value in values:
+            self.append(value)
+
+    def clear(self):
+        self._end = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def values(self):
+        """Returns the buffered values, oldest first."""
+        if self._size < self._capacity:
+            return self._data[:self._size]
+        return self._data[self._end:] + self._data[:self._end]
+
+    def min(self):
+        return min(self._data) if self._size == self._capacity else min(self._data[:self._size])
+
+    def max(self):
+        return max(self._data) if self._size == self._capacity else max(self._data[:self._size])
+
+    def normalized(self, scale):
+        """Returns the values scaled to 0..scale together with their minimum and maximum."""
+        values = self.values()
+        data_min = min(values)
+        data_max = max(values)
+        factor = scale / ((data_max - data_min) or 1)
+        return [int((x - data_min) * factor) for x in values], data_min, data_max
+
+class SensorHistory:
+    """Keeps the latest readings of every sensor, independent of what is displayed."""
+
+    def __init__(self, capacity):
+        self._capacity = capacity
+        self._buffers = {}
+
+    def record(self, sensor_data):
+        for (data, reading) in zip(sensor_data, sensor_data.snapshot()):
+            if reading.current is not None:
+                self[data.title].append(reading.current)
+
+    def __getitem__(self, title):
+        buffer = self._buffers.get(title)
+        if buffer is None:
+            buffer = self._buffers[title] = RingBuffer(self._capacity)
+        return buffer
@@ -0,0 +1,126 @@
+from tinkerforge.bricklet_lcd_128x64 import BrickletLCD128x64
+
+from history import SensorHistory
+
+class LCD_Display:
+    UID = "24Rh"
+    TAB_TEXTS = ("Temp.", "Lumi.", "Moist")
+
+    # number of values shown in the graph
+    GRAPH_WIDTH = 60
+    # the brick accepts graph data in chunks of 59 values
+    GRAPH_CHUNK_SIZE = 59
+
+    # the min/max labels are drawn left of the graph
+    LABEL_WIDTH = 49
+    LABEL_HEIGHT = 8
+    MAX_LABEL_Y = 0
+    MIN_LABEL_Y = 40
+
+    def __init__(self, conn, uid=UID):
+        self.lcd = BrickletLCD128x64(uid, conn)
+        self.current_tab = 1
+        # called from the callback thread when the tab was changed on the display
+        self.on_tab_selected = None
+
+        # recent readings of every sensor, so the graph is complete after a tab switch
+        self.history = SensorHistory(self.GRAPH_WIDTH)
+        self.graph_title = None
+        self.graph_unit = []
+
+        # model of what is currently shown on the display, None forces a full redraw
+        self._shown = None
+
+        # number of RPCs sent by the last `render` call and in total
+        self.frame_rpcs = 0
+        self.total_rpcs = 0
+
+    def setup(self):
+        self.lcd.register_callback(self.lcd.CALLBACK_GUI_TAB_SELECTED, self.select_tab)
+        self.lcd.set_gui_tab_selected_callback_configuration(100, False)
+
+    def select_tab(self, index):
+        # the display switched the tab on its own
+        if self._shown is not None:
+            self._shown["tab"] = index
+
+        self.current_tab = index
+        if self.on_tab_selected is not None:
+            self.on_tab_selected()
+
+    def tick(self, sensor_data):
+        self.history.record(sensor_data)
+
+        datum = sensor_data[self.current_tab]
+        self.graph_title = datum.title
+        self.graph_unit = datum.unit
+
+    def invalidate(self):
+        """Forgets what is shown on the display, so the next `render` redraws everything."""
+        self._shown = None
+
+    def _send(self, function, *args, rpcs=1):
+        function(*args)
+        self.frame_rpcs += rpcs
+
+    def render(self):
+        """Sends only what changed since the last frame. Returns the number of RPCs sent."""
+        self.frame_rpcs = 0
+
+        shown = self._shown
+        if shown is None:
+            self._send(self.lcd.clear_display)
+            self._send(self.lcd.remove_all_gui)
+
+            self._send(self.lcd.set_gui_tab_configuration, self.lcd.CHANGE_TAB_ON_CLICK_AND_SWIPE, False)
+            for (index, text) in enumerate(self.TAB_TEXTS):
+                self._send(self.lcd.set_gui_tab_text, index, text)
+
+            shown = self._shown = {"tab": None, "graph": None, "data": None, "max": None, "min": None}
+
+        if shown["tab"] != self.current_tab:
+            self._send(self.lcd.set_gui_tab_selected, self.current_tab)
+            shown["tab"] = self.current_tab
+
+        graph_data = self.history[self.graph_title] if self.graph_title is not None else None
+        if graph_data:
+            # draw graph
+            normalized, data_min, data_max = graph_data.normalized(240)
+
+            graph = (self.lcd.GRAPH_TYPE_LINE, 50, 0, self.GRAPH_WIDTH, 52, "t", self.graph_unit)
+            if shown["graph"] != graph:
+                self._send(self.lcd.set_gui_graph_configuration, 0, *graph)
+                shown["graph"] = graph
+                shown["data"] = None
+
+            if shown["data"] != normalized:
+                chunks = -(-len(normalized) // self.GRAPH_CHUNK_SIZE)
+                self._send(self.lcd.set_gui_graph_data, 0, normalized, rpcs=chunks)
+                shown["data"] = normalized
+
+            self._draw_label("max", self.MAX_LABEL_Y, f"{round(data_max, 2)}")
+            self._draw_label("min", self.MIN_LABEL_Y, f"{round(data_min, 2)}")
+        else:
+            if shown["graph"] is not None:
+                self._send(self.lcd.remove_gui_graph, 0)
+                shown["graph"] = None
+                shown["data"] = None
+
+            self._draw_label("max", self.MAX_LABEL_Y, None)
+            self._draw_label("min", self.MIN_LABEL_Y, None)
+
+        self.total_rpcs += self.frame_rpcs
+        return self.frame_rpcs
+
+    def _draw_label(self, key, y, text):
+        if self._shown[key] == text:
+            return
+
+        # erase the previous text
+        if self._shown[key] is not None:
+            self._send(self.lcd.draw_box, 0, y, self.LABEL_WIDTH, y + self.LABEL_HEIGHT - 1, True, self.lcd.COLOR_WHITE)
+
+        if text is not None:
+            self._send(self.lcd.draw_text, 6, y, self.lcd.FONT_6X8, self.lcd.COLOR_BLACK, text)
+
+        self._shown[key] = text
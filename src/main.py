@@ -1,253 +1,258 @@
-import os
-from datetime import datetime
+# first, so the startup profile includes all imports
+from components import STARTUP, Component
 
-# discord-notification imports
-import http.client
-import json
+import os
 import time
-import discord
+import traceback
 
 from count_down import CountDown
+from devices import DeviceRegistry, load_config
+from events import EventBus
 from alarm import Alarm
-from doom import doom_main
+from alerts import AlertEngine, rules_from_config
 from nfc_reader import NfcReader
 from motion_detection import MotionDetection
+from scheduler import Scheduler
+from sensor_data import SensorData
+from terminal import TerminalRenderer
+from timeseries import TimeSeriesLog
 
-from tinkerforge.ip_connection import IPConnection
-
-from tinkerforge.bricklet_ptc_v2 import BrickletPTCV2
-from tinkerforge.bricklet_ambient_light_v3 import BrickletAmbientLightV3
-from tinkerforge.bricklet_humidity_v2 import BrickletHumidityV2
-
-from tinkerforge.bricklet_e_paper_296x128 import BrickletEPaper296x128
-from tinkerforge.bricklet_lcd_128x64 import BrickletLCD128x64
-
-class Statistics:
-    def __init__(self, title, unit, min, max, critical_min=None, critical_max=None):
-        self._current = None
-        self.is_critical = False
-
-        self.title = title
-        self.unit = unit
-        self.measured_minimum = max
-        self.measured_maximum = min
-
-        self.critical_min = critical_min
-        self.critical_max = critical_max
-
-        # time stamp when the last notification was send
-        self.last_notified = datetime(2000, 1, 1)
-
-    def set_current(self, value):
-        self._current = value
-        self.measured_minimum = min(self.measured_minimum, value)
-        self.measured_maximum = max(self.measured_maximum, value)
-
-        self.is_critical = (
-                self.critical_min is not None and self.critical_min > self._current
-        ) or (
-                self.critical_max is not None and self.critical_max < self._current
-        )
-
-    def get_current(self):
-        return self._current
-
-    def __str__(self):
-        return f"""
-        {self.title}
-        current: {self._current}{self.unit}
-        minimum: {self.measured_minimum}{self.unit}
-        maximum: {self.measured_maximum}{self.unit}
-        """.strip()
-
-# used as global state
-class SensorData:
-    def __init__(self):
-        self.temperature = Statistics("TEMPERATURE", "C", 0, 80)
-        self.illuminance = Statistics("ILLUMINANCE", "lx", 0, 1600, critical_min=50)
-        self.moisture = Statistics("MOISTURE", "%RH", 0, 100)
-
-    def __iter__(self):
-        yield self.temperature
-        yield self.illuminance
-        yield self.moisture
-
-        return StopIteration
-
-    def __getitem__(self, idx):
-        return list(self)[idx]
-
-    def __str__(self):
-        return "\n".join([str(data) for data in self])
+from metrics import METRICS, MeteredIPConnection
+from outbox import OUTBOX_PATH, count_messages
+from replay import RecordingIPConnection, TraceWriter
 
 SENSOR_DATA = SensorData()
 
-IP = "172.20.10.242"
-PORT = 4223
+# hosts which could not be reached are retried with this interval (in seconds)
+CONNECT_INTERVAL = 10
 
-# delay between notification when a critical measurement is taken
+# delay between reminders while a sensor stays critical, unless the config has its own alert rules
 NOTIFICATION_DELAY_SECONDS = 60 * 5
+# alerts fired within this window (in seconds) are sent as one message
+ALERT_DIGEST_WINDOW = 10
 
-def temperature_callback(temperature):
-    SENSOR_DATA.temperature.set_current(temperature / 100)
-
-def ambient_light_callback(illuminance):
-    SENSOR_DATA.illuminance.set_current(illuminance / 100)
-
-def moisture_callback(moisture):
-    SENSOR_DATA.moisture.set_current(moisture / 100)
-
-class LCD_Display:
-    UID = "24Rh"
-
-    def __init__(self, conn):
-        self.lcd = BrickletLCD128x64(LCD_Display.UID, conn)
-        self.current_tab = 1
-
-        # data for the current tab
-        self.graph_data = []
-        self.graph_unit = []
-
-    def setup(self):
-        self.lcd.register_callback(self.lcd.CALLBACK_GUI_TAB_SELECTED, self.select_tab)
-        self.lcd.set_gui_tab_selected_callback_configuration(100, False)
-
-    def select_tab(self, index):
-        if self.current_tab != index:
-            self.current_tab = index
-            self.graph_data = []
-
-    def tick(self, sensor_data):
-        datum = sensor_data[self.current_tab]
-        self.graph_data.append(datum.get_current())
-        self.graph_unit = datum.unit
+# the LCD graph is sampled with this interval (in seconds)
+LCD_INTERVAL = 0.1
+# a postponed e-paper refresh is retried with this interval (in seconds), PaperDisplay.MIN_REFRESH_INTERVAL
+PAPER_INTERVAL = 2
+# the alarm sound is repeated with this interval (in seconds)
+ALARM_INTERVAL = 0.1
 
-    def render(self):
-        self.lcd.clear_display()
-        self.lcd.remove_all_gui()
+# the NFC whitelist file is checked for changes with this interval (in seconds)
+WHITELIST_RELOAD_INTERVAL = 5
 
-        self.lcd.set_gui_tab_configuration(self.lcd.CHANGE_TAB_ON_CLICK_AND_SWIPE, False)
+# the Doom process is checked for a finished game with this interval (in seconds)
+DOOM_POLL_INTERVAL = 1
 
-        self.lcd.set_gui_tab_text(0, "Temp.")
-        self.lcd.set_gui_tab_text(1, "Lumi.")
-        self.lcd.set_gui_tab_text(2, "Moist")
+# all readings are logged to files starting with this path
+HISTORY_PATH = "history"
+# the log is written to disk with this interval (in seconds)
+HISTORY_FLUSH_INTERVAL = 60
 
-        self.lcd.set_gui_tab_selected(self.current_tab)
+# metrics are served for Prometheus on this local port, see metrics.py
+METRICS_PORT = 9464
+# a summary of the metrics is printed with this interval (in seconds) while they are enabled
+METRICS_LOG_INTERVAL = 60
 
-        if self.graph_data:
-            # draw graph
-            data_begin = 0 if len(self.graph_data) <= 60 else len(self.graph_data) - 60
+SCHEDULER = Scheduler()
 
-            data = self.graph_data[data_begin:]
-
-            data_min = min(data)
-            data_max = max(data)
-            def normalize(data):
-                return [int(((x - data_min) / ((data_max - data_min) or 1)) * 240) for x in data]
-
-            self.lcd.set_gui_graph_configuration(0, self.lcd.GRAPH_TYPE_LINE, 50, 0, 60, 52, "t", self.graph_unit)
-            self.lcd.set_gui_graph_data(0, normalize(data))
-
-            self.lcd.draw_text(
-                6, 0,
-                self.lcd.FONT_6X8,
-                self.lcd.COLOR_BLACK,
-                f"{round(data_max, 2)}")
-            self.lcd.draw_text(
-                6, 40,
-                self.lcd.FONT_6X8,
-                self.lcd.COLOR_BLACK,
-                f"{round(data_min, 2)}")
+# OBSERVER_PROFILE=1 prints the import and initialisation time of every component, see components.py
+PROFILE_ENV = "OBSERVER_PROFILE"
 
 if __name__ == "__main__":
-    conn = IPConnection()
-
-    # actors
-    paper_display = BrickletEPaper296x128("24KJ", conn)
-    lcd_display = LCD_Display(conn)
+    STARTUP.verbose = bool(os.environ.get(PROFILE_ENV))
+    STARTUP.record("imports", STARTUP.elapsed(), 0)
+
+    config = load_config()
+    # bricklet callbacks only queue events, their handlers run one after another on the dispatcher thread
+    events = EventBus().start()
+    # OBSERVER_TRACE=trace.bin records all bricklet traffic for replay.py
+    trace = TraceWriter(os.environ["OBSERVER_TRACE"]) if os.environ.get("OBSERVER_TRACE") else None
+    if trace is None:
+        connection_factory = lambda host: MeteredIPConnection(labels=(("host", host),))
+    else:
+        connection_factory = lambda host: RecordingIPConnection(trace, labels=(("host", host),))
+    with STARTUP.step("sensors"):
+        registry = DeviceRegistry(config, connection_factory, events)
+        registry.add_sensors(SENSOR_DATA)
+    for sampler in registry.samplers:
+        METRICS.gauge("sensor_callbacks_saved_per_second", sampler.saved_per_second, (("sensor", sampler.statistics.title),))
+    # started by a job once the monitoring loop is live
+    metrics_server = Component("metrics server", "metrics", lambda module: module.MetricsServer(METRICS, port=METRICS_PORT).start())
+
+    with STARTUP.step("history"):
+        history = TimeSeriesLog(HISTORY_PATH)
+    # sensors whose names no longer fit into the history file, they are reported once and not logged
+    unlogged = set()
+    def log_reading(data, reading):
+        if data.title in unlogged:
+            return
+        try:
+            history.append(data.title, reading.current)
+        except ValueError as e:
+            unlogged.add(data.title)
+            print(f"Not logging {data.title}: {e}")
+    SENSOR_DATA.subscribe(log_reading)
+    SENSOR_DATA.subscribe(lambda data, reading: SCHEDULER.notify("sensors"))
+
+    # the webhook is read and the outbox opened with the first message
+    notifier = Component("notifier", "discord", lambda module: module.get_notifier())
+    with STARTUP.step("alerts"):
+        alerts = AlertEngine(rules_from_config(config, SENSOR_DATA, NOTIFICATION_DELAY_SECONDS),
+                             lambda message: notifier.get().send(message), digest_window=ALERT_DIGEST_WINDOW)
+    SENSOR_DATA.subscribe(alerts.on_reading)
 
     # sensors
-    count_down = CountDown(conn)
-    alarm = Alarm(conn, count_down, 1)
-    nfc_reader = NfcReader(conn, count_down, alarm)
-    motion_detection = MotionDetection(conn, count_down, alarm)
-
-    ambient_light = BrickletAmbientLightV3("Pdw", conn)
-    temperature = BrickletPTCV2("Wcg", conn)
-    moisture_sensor = BrickletHumidityV2("ViW", conn)
-
-    conn.connect(IP, PORT)
-
-    # register callbacks
-    temperature.register_callback(temperature.CALLBACK_TEMPERATURE, temperature_callback)
-    temperature.set_temperature_callback_configuration(1000, False, "x", 0, 0)
-
-    ambient_light.register_callback(ambient_light.CALLBACK_ILLUMINANCE, ambient_light_callback)
-    ambient_light.set_illuminance_callback_configuration(1000, False, "x", 0, 0)
-
-    moisture_sensor.register_callback(moisture_sensor.CALLBACK_HUMIDITY, moisture_callback)
-    moisture_sensor.set_humidity_callback_configuration(1000, False, "x", 0, 0)
-
-    lcd_display.setup()
-    alarm.setup()
-    nfc_reader.setup()
-    motion_detection.setup()
-
-    count = 0
-
-    try:
-        while True:
-            # clear screen
-            if os.name == "nt":
-                os.system("cls")
-            else:
-                os.system("clear")
-
-            if nfc_reader.doom_mode:
-                try:
-                    doom_main()
-                finally:
-                    nfc_reader.doom_mode = False
-
-            now = datetime.now()
-            print(lcd_display.current_tab)
-
-            print(SENSOR_DATA)
-
-            lcd_display.tick(SENSOR_DATA)
+    with STARTUP.step("alarm"):
+        count_down = CountDown(registry.connection("segment_display"), registry.uid("segment_display"), events)
+        alarm = Alarm(registry.connection("speaker"), count_down, 1, registry.uid("speaker"), registry.uid("button"),
+                      button_conn=registry.connection("button"), events=events)
+        nfc_reader = NfcReader(registry.connection("nfc"), count_down, alarm, registry.uid("nfc"),
+                               config["devices"]["nfc"].get("whitelist", NfcReader.WHITELIST_PATH), events,
+                               legacy_suffixes=config["devices"]["nfc"].get("legacy_suffixes", False))
+        motion_detection = MotionDetection(registry.connection("motion"), count_down, alarm, registry.uid("motion"), events)
+
+    # set up again after every reconnect, a restarted brick forgets its configuration
+    registry.on_connected("button", alarm.setup)
+    registry.on_connected("speaker", alarm.setup_speaker)
+    registry.on_connected("segment_display", count_down.setup)
+    registry.on_connected("nfc", nfc_reader.setup)
+    registry.on_connected("motion", motion_detection.setup)
+    registry.connect()
+
+    nfc_reader.on_doom_mode = lambda: SCHEDULER.notify("doom")
+
+    # the displays, the notifier and Doom are components which are only imported and set up on first use;
+    # the displays by their first update right after the scheduler started
+    def load_lcd(module):
+        lcd_display = module.LCD_Display(registry.connection("lcd"), registry.uid("lcd"))
+        # continue the graphs with the readings logged within their time span, e.g. before a quick restart
+        now = time.time()
+        for data in SENSOR_DATA:
+            lcd_display.history[data.title].extend(history.resample(data.title, now, LCD_INTERVAL, module.LCD_Display.GRAPH_WIDTH))
+        lcd_display.on_tab_selected = lambda: SCHEDULER.notify("tab")
+        registry.on_connected("lcd", lambda: (lcd_display.setup(), lcd_display.invalidate()))
+        return lcd_display
+
+    def load_paper(module):
+        paper_display = module.PaperDisplay(registry.connection("paper"), registry.uid("paper"))
+        registry.on_connected("paper", paper_display.invalidate)
+        return paper_display
+
+    lcd = Component("lcd", "lcd_display", load_lcd)
+    paper = Component("paper", "paper_display", load_paper)
+    # the game itself runs in its own process, this only loads its supervisor on the first doom card
+    doom = Component("doom", "doom_supervisor", lambda module: module.DoomSupervisor(config))
+
+    terminal = TerminalRenderer()
+
+    def doom_running():
+        return doom.loaded and doom.get().is_running()
+
+    def update_lcd():
+        lcd_display = lcd.get()
+        lcd_display.tick(SENSOR_DATA)
+        # the game owns the LCD while it is running, the graphs are still sampled so they have no gap afterwards
+        if not doom_running():
             lcd_display.render()
 
-            paper_display.fill_display(paper_display.COLOR_WHITE)
-            if count % 20 == 0:
-                for (i, data) in enumerate(SENSOR_DATA):
-                    paper_display.draw_text(
-                        8, 16 * (i + 1),
-                        paper_display.FONT_12X16,
-                        paper_display.COLOR_RED if data.is_critical else paper_display.COLOR_BLACK,
-                        paper_display.ORIENTATION_HORIZONTAL,
-                        f"{data.title}:{data.get_current()} {data.unit}")
-                paper_display.draw()
-
-            for data in SENSOR_DATA:
-                notified_seconds_ago = (now - data.last_notified).total_seconds()
-                if(data.is_critical and notified_seconds_ago > NOTIFICATION_DELAY_SECONDS):
-                    discord.send(f"illuminance is critical: {SENSOR_DATA.illuminance.get_current()}{SENSOR_DATA.illuminance.unit}")
-                    data.last_notified = now
-
-            alarm.update()
-            count += 1
-
-            time.sleep(0.1)
+    def update_paper():
+        paper.get().render(SENSOR_DATA)
+
+    def update_console():
+        # shows the displays once their jobs loaded them, without loading them itself
+        (lcd_display, paper_display) = (lcd.get() if lcd.loaded else None, paper.get() if paper.loaded else None)
+        terminal.render("\n".join([
+            str(lcd_display.current_tab if lcd_display else "-"),
+            str(SENSOR_DATA),
+            f"LCD RPCs last frame: {lcd_display.frame_rpcs} (total {lcd_display.total_rpcs})" if lcd_display else "LCD: not loaded",
+            f"e-paper refreshes: {paper_display.full_refreshes} full, {paper_display.delta_refreshes} delta, {paper_display.refreshes_skipped} skipped"
+            if paper_display else "e-paper: not loaded",
+            f"sensor callbacks saved: {sum(sampler.saved_per_second() for sampler in registry.samplers):.2f}/s "
+            f"({', '.join(f'{sampler.statistics.title} {sampler.mode}' for sampler in registry.samplers)})",
+            f"alerts: {alerts.alerts} in {alerts.digests} messages",
+            f"events: {events.dispatched} handled, {events.coalesced} coalesced",
+            f"Doom: {'running' if doom_running() else 'stopped'}, last game LCD frames: {doom.get().last_stats if doom.loaded else None}",
+        ]))
+
+    def supervise_doom():
+        # a game which ended is reaped first, so a doom card scanned meanwhile starts a new one
+        if doom.loaded and doom.get().poll():
+            alarm.resume_button()
+            # the game drew over the LCD
+            lcd.get().invalidate()
+            SCHEDULER.notify("tab")
+
+        # a doom card starts a game or ends the running one
+        if nfc_reader.doom_mode:
+            nfc_reader.doom_mode = False
+            if doom_running():
+                doom.get().stop()
+            else:
+                # the game process takes over the LCD and the button as fire button
+                alarm.suspend_button()
+                doom.get().start()
+
+    def replay_outbox():
+        # notifications left in the outbox by the last run are sent without waiting for a new one,
+        # an unreadable outbox is left to the notifier as well
+        if count_messages(OUTBOX_PATH) != 0:
+            notifier.get()
+
+    def report_startup():
+        # every job runs once when the scheduler starts, so the monitoring loop is live now
+        STARTUP.record("live", 0, 0)
+        if STARTUP.verbose:
+            print(f"\nstartup:\n{STARTUP.report()}")
+
+    def log_metrics():
+        if METRICS.enabled:
+            print(f"\nmetrics:\n{METRICS.summary()}")
+
+    SCHEDULER.add("startup", report_startup)
+    SCHEDULER.add("outbox", replay_outbox)
+    SCHEDULER.add("metrics server", metrics_server.get)
+    SCHEDULER.add("lcd", update_lcd, interval=LCD_INTERVAL, events=("tab",))
+    # the e-paper display may postpone a refresh, so retry regularly
+    SCHEDULER.add("paper", update_paper, interval=PAPER_INTERVAL, events=("sensors",))
+    SCHEDULER.add("console", update_console, interval=1, events=("sensors", "tab"), min_interval=0.1)
+    # rules are evaluated by the listener, this only fires due timers and sends the digests
+    SCHEDULER.add("alerts", alerts.tick, interval=1)
+    SCHEDULER.add("alarm", alarm.update, interval=ALARM_INTERVAL)
+    SCHEDULER.add("doom", supervise_doom, interval=DOOM_POLL_INTERVAL, events=("doom",))
+    SCHEDULER.add("whitelist", nfc_reader.whitelist.reload, interval=WHITELIST_RELOAD_INTERVAL)
+    SCHEDULER.add("history", history.flush, interval=HISTORY_FLUSH_INTERVAL)
+    SCHEDULER.add("metrics", log_metrics, interval=METRICS_LOG_INTERVAL)
+    SCHEDULER.add("connect", registry.connect, interval=CONNECT_INTERVAL)
 
+    try:
+        SCHEDULER.run_forever()
     except KeyboardInterrupt:
         # the user ended the program so we absorb the exception
         pass
     finally:
-        # gracefully close the connection
-        conn.disconnect()
+        if doom.loaded:
+            doom.get().stop()
+
+        # gracefully close the connections
+        registry.disconnect()
         print("\rconnection closed")
 
-        discord.send(f"""
+        # the local files first, a missing webhook or a failing notifier must not leave them truncated
+        history.close()
+        if trace is not None:
+            trace.close()
+        if metrics_server.loaded:
+            metrics_server.get().stop()
+
+        try:
+            alerts.flush()
+            notifier.get().send(f"""
             Data before disconnect:
                 {str(SENSOR_DATA)}
             """)
+            # don't let an unreachable webhook block the shutdown
+            notifier.get().close(timeout=5)
+        except Exception:
+            print("Sending the last notifications failed:")
+            traceback.print_exc()
@@ -0,0 +1,260 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from tinkerforge.ip_connection import IPConnection, get_uid_from_data
+
+# upper bounds of the histogram buckets in seconds
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# prepended to every metric name in the Prometheus output
+PREFIX = "observer_"
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds=BUCKETS):
+        self.bounds = bounds
+        # the last bucket counts everything above the largest bound
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket which holds the `q` quantile, inf if it is above all bounds."""
+        rank = q * self.count
+        total = 0
+        for (bound, count) in zip(self.bounds, self.counts):
+            total += count
+            if total >= rank:
+                return bound
+        return float("inf")
+
+class _Timer:
+    __slots__ = ("_metrics", "_name", "_labels", "_start")
+
+    def __init__(self, metrics, name, labels):
+        self._metrics = metrics
+        self._name = name
+        self._labels = labels
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self._metrics.observe(self._name, time.perf_counter() - self._start, self._labels)
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+_NULL_TIMER = _NullTimer()
+
+class Metrics:
+    """Counters, histograms and gauges of the hot paths, only recorded while `enabled` is set.
+
+    Labels are tuples of (name, value) pairs.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        # gauges are functions which are only called when the metrics are read
+        self._gauges = {}
+
+    def count(self, name, labels=(), amount=1):
+        if not self.enabled:
+            return
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, labels=()):
+        if not self.enabled:
+            return
+        key = (name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def time(self, name, labels=()):
+        """Context manager which observes the duration of its block, a shared no-op while disabled."""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name, labels)
+
+    def set_histogram(self, name, histogram, labels=()):
+        """Replaces a histogram, e.g. with one measured by another process."""
+        with self._lock:
+            self._histograms[(name, labels)] = histogram
+
+    def gauge(self, name, function, labels=()):
+        self._gauges[(name, labels)] = function
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def _snapshot(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: (list(histogram.counts), histogram.sum, histogram.count, histogram)
+                          for (key, histogram) in self._histograms.items()}
+        gauges = {}
+        for (key, function) in list(self._gauges.items()):
+            try:
+                gauges[key] = function()
+            except Exception:
+                pass
+        return (counters, histograms, gauges)
+
+    def render(self):
+        """Returns all metrics in the Prometheus text format."""
+        (counters, histograms, gauges) = self._snapshot()
+        lines = [f"# TYPE {PREFIX}metrics_enabled gauge", f"{PREFIX}metrics_enabled {int(self.enabled)}"]
+
+        for (kind, values) in (("counter", counters), ("gauge", gauges)):
+            for name in sorted({name for (name, _) in values}):
+                lines.append(f"# TYPE {PREFIX}{name} {kind}")
+                for ((metric, labels), value) in values.items():
+                    if metric == name:
+                        lines.append(f"{PREFIX}{name}{_labels(labels)} {value}")
+
+        for name in sorted({name for (name, _) in histograms}):
+            lines.append(f"# TYPE {PREFIX}{name} histogram")
+            for ((metric, labels), (counts, total, count, histogram)) in histograms.items():
+                if metric != name:
+                    continue
+                cumulative = 0
+                for (bound, bucket) in zip(histogram.bounds + ("+Inf",), counts):
+                    cumulative += bucket
+                    lines.append(f"{PREFIX}{name}_bucket{_labels(labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{PREFIX}{name}_sum{_labels(labels)} {total}")
+                lines.append(f"{PREFIX}{name}_count{_labels(labels)} {count}")
+
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """Returns a short human readable overview, one line per metric."""
+        (counters, histograms, gauges) = self._snapshot()
+        lines = []
+        for ((name, labels), (_, total, count, histogram)) in sorted(histograms.items()):
+            if count:
+                lines.append(f"{name}{_labels(labels)}: {count} x {total / count * 1000:.2f} ms, "
+                             f"p95 <= {histogram.quantile(0.95) * 1000:g} ms")
+        for ((name, labels), value) in sorted(counters.items()) + sorted(gauges.items()):
+            lines.append(f"{name}{_labels(labels)}: {value}")
+        return "\n".join(lines)
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for (name, value) in labels) + "}"
+
+# the metrics of this process, OBSERVER_METRICS=1 enables them at startup
+METRICS = Metrics(enabled=os.environ.get("OBSERVER_METRICS") == "1")
+
+_function_names = {}
+
+def function_name(device, function_id):
+    """Name of a bricklet function, e.g. write_pixels_low_level."""
+    names = _function_names.get(type(device))
+    if names is None:
+        names = _function_names[type(device)] = {
+            value: name[len("FUNCTION_"):].lower()
+            for (name, value) in vars(type(device)).items() if name.startswith("FUNCTION_")
+        }
+    return names.get(function_id, str(function_id))
+
+class MeteredIPConnection(IPConnection):
+    """IPConnection which times requests per bricklet and function, and the handling of callbacks."""
+
+    def __init__(self, metrics=METRICS, labels=()):
+        IPConnection.__init__(self)
+        self._metrics = metrics
+        metrics.gauge("callback_queue_depth", self._callback_queue_depth, labels)
+
+    def _callback_queue_depth(self):
+        callback = self.callback
+        return callback.queue.qsize() if callback is not None else 0
+
+    def send_request(self, device, function_id, data, form, length_ret, form_ret):
+        if not self._metrics.enabled:
+            return IPConnection.send_request(self, device, function_id, data, form, length_ret, form_ret)
+
+        labels = (("device", device.uid_string), ("function", function_name(device, function_id)))
+        with self._metrics.time("rpc_seconds", labels):
+            return IPConnection.send_request(self, device, function_id, data, form, length_ret, form_ret)
+
+    def dispatch_packet(self, packet):
+        # runs on the callback thread
+        if not self._metrics.enabled:
+            return IPConnection.dispatch_packet(self, packet)
+
+        device = self.devices.get(get_uid_from_data(packet))
+        labels = (("device", device.uid_string if device is not None else "unknown"),)
+        with self._metrics.time("callback_seconds", labels):
+            return IPConnection.dispatch_packet(self, packet)
+
+class MetricsServer:
+    """Serves the metrics for Prometheus on /metrics, POST /enable and /disable switch the recording."""
+
+    def __init__(self, metrics=METRICS, host="127.0.0.1", port=9464):
+        # only imported here, http.server takes longer to import than all of the rest of the program
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                if self.path not in ("/enable", "/disable"):
+                    self.send_error(404)
+                    return
+                metrics.enabled = self.path == "/enable"
+                self.send_response(204)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, name="metrics-server", daemon=True)
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/metrics"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
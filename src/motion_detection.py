@@ -1,13 +1,21 @@
 from tinkerforge.bricklet_motion_detector_v2 import BrickletMotionDetectorV2
 
+from events import callback
+
 class MotionDetection:
-    def __init__(self, conn, count_down, alarm):
-        self._motion_detection = BrickletMotionDetectorV2("ML4", conn)
+    UID = "ML4"
+    # motion detected again within this time (in seconds) is handled only once
+    MOTION_COALESCE = 1
+
+    def __init__(self, conn, count_down, alarm, uid=UID, events=None):
+        self._motion_detection = BrickletMotionDetectorV2(uid, conn)
         self._count_down = count_down
         self._alarm = alarm
+        self._events = events
 
     def setup(self):
-        self._motion_detection.register_callback(self._motion_detection.CALLBACK_MOTION_DETECTED, self.start_motion_detection)
+        self._motion_detection.register_callback(self._motion_detection.CALLBACK_MOTION_DETECTED,
+                                                 callback(self._events, "motion", self.start_motion_detection, self.MOTION_COALESCE))
 
     def start_motion_detection(self):
         if self._alarm.can_trigger():
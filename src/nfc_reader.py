@@ -1,38 +1,69 @@
+import time
+
 from tinkerforge.bricklet_nfc import BrickletNFC
 
+from events import callback
+from metrics import METRICS
+from whitelist import DISARM, DOOM, TagWhitelist
+
 class NfcReader:
+    UID = "22ND"
+    # with `legacy_suffixes` and without a whitelist file, tags are recognised by the last byte of their ID
     VALID_NFC_ID_SUFFIX = 0x90
     DOOM_NFC_SUFFIC = 0x80
+    WHITELIST_PATH = "nfc_whitelist.txt"
 
-    def __init__(self, conn, count_down, alarm):
+    def __init__(self, conn, count_down, alarm, uid=UID, whitelist_path=WHITELIST_PATH, events=None, legacy_suffixes=False):
         self._alarm = alarm
         self._count_down = count_down
-        self._nfc = BrickletNFC("22ND", conn)
+        self._nfc = BrickletNFC(uid, conn)
+        self.whitelist = TagWhitelist(whitelist_path, {self.VALID_NFC_ID_SUFFIX: DISARM, self.DOOM_NFC_SUFFIC: DOOM}
+                                      if legacy_suffixes else None)
+        self.whitelist.reload()
+        if not len(self.whitelist) and not legacy_suffixes:
+            print(f"No tags in the NFC whitelist {whitelist_path}, no card is accepted")
         self.doom_mode = False
+        # called from the event dispatcher when a doom card was scanned
+        self.on_doom_mode = None
+
+        # handled by the event dispatcher, so the callback thread isn't held up by the tag ID request
+        self._handle_state = callback(events, "nfc", self._handle)
+
+        # seconds from the tag being reported to the decision, of the last tag
+        self.last_latency = None
 
     def setup(self):
-        self._nfc.register_callback(self._nfc.CALLBACK_READER_STATE_CHANGED,
-                            lambda x, y: self.cb_reader_state_changed(x, y, self._nfc))
+        self._nfc.register_callback(self._nfc.CALLBACK_READER_STATE_CHANGED, self.cb_reader_state_changed)
         self._nfc.set_mode(self._nfc.MODE_READER)
 
-    def cb_reader_state_changed(self, state, idle, nfc):
+    def cb_reader_state_changed(self, state, idle):
+        # runs on the callback thread
+        self._handle_state(state, idle, time.perf_counter())
+
+    def _handle(self, state, idle, reported):
+        nfc = self._nfc
         if state == nfc.READER_STATE_REQUEST_TAG_ID_READY:
             ret = nfc.reader_get_tag_id()
-            tag_id = list(ret.tag_id)
+            role = self.whitelist.lookup(ret.tag_id)
+            self.last_latency = time.perf_counter() - reported
+            METRICS.observe("nfc_recognition_seconds", self.last_latency)
+            METRICS.count("nfc_tags", (("role", role or "unknown"),))
 
             print("Found tag of type " +
                 str(ret.tag_type) +
                 " with ID [" +
-                " ".join(map(str, map('0x{:02X}'.format, ret.tag_id))) +
+                " ".join(map('0x{:02X}'.format, ret.tag_id)) +
                 "]")
 
-            if tag_id[-1] == self.VALID_NFC_ID_SUFFIX:
+            if role == DISARM:
                 print("Valid NFC card scanned - Stopping countdown and disabling motion detection")
                 self._count_down.stop_count_down()
                 self._alarm.enable_reset()
                 self._count_down.disable_motion_detection()  # Verwende die neue Methode!
-            elif tag_id[-1] == self.DOOM_NFC_SUFFIC:
+            elif role == DOOM:
                 self.doom_mode = True
+                if self.on_doom_mode is not None:
+                    self.on_doom_mode()
             else:
                 print("Scanned card doesn't match Whitelist. Try another card")
 
@@ -0,0 +1,89 @@
+import os
+import sqlite3
+import threading
+import time
+
+# messages of the notifier which were not delivered yet are kept in this file across restarts
+OUTBOX_PATH = "outbox.db"
+
+def count_messages(path=OUTBOX_PATH):
+    """Number of messages stored in an outbox file, 0 without the file, None if it can't be read.
+
+    Opens the file read-only, which is cheaper than an Outbox and doesn't create it.
+    """
+    if not os.path.exists(path):
+        return 0
+    try:
+        connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    except sqlite3.Error:
+        return None
+    try:
+        (count,) = connection.execute("SELECT COUNT(*) FROM messages").fetchone()
+        return count
+    except sqlite3.Error:
+        return None
+    finally:
+        connection.close()
+
+class Outbox:
+    """Durable FIFO of messages in a SQLite database in WAL mode, which survives crashes and restarts.
+
+    Every append is a single short transaction. At most `max_messages` are kept, the oldest are dropped beyond
+    that, so a long outage neither fills the disk nor the memory. ":memory:" keeps the messages in memory only.
+    """
+
+    def __init__(self, path, max_messages=10000):
+        self.max_messages = max_messages
+        self._lock = threading.Lock()
+        # autocommit, so every statement is its own transaction
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        # commits only append to the WAL, a power loss may lose the latest messages but never corrupts the file
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY AUTOINCREMENT, created REAL NOT NULL, content TEXT NOT NULL)"
+        )
+        (self._count,) = self._connection.execute("SELECT COUNT(*) FROM messages").fetchone()
+
+    def __len__(self):
+        return self._count
+
+    def append(self, content):
+        """Stores a message, returns the number of old messages dropped to stay within `max_messages`."""
+        with self._lock:
+            self._connection.execute("INSERT INTO messages (created, content) VALUES (?, ?)", (time.time(), content))
+            self._count += 1
+            if self._count <= self.max_messages:
+                return 0
+            dropped = self._connection.execute(
+                "DELETE FROM messages WHERE id IN (SELECT id FROM messages ORDER BY id LIMIT ?)",
+                (self._count - self.max_messages,)
+            ).rowcount
+            self._count -= dropped
+            return dropped
+
+    def peek(self, max_length):
+        """Returns the oldest messages as (id, content) whose contents joined by newlines fit into `max_length`
+        characters, but at least one."""
+        batch = []
+        length = -1
+        with self._lock:
+            for (id, content) in self._connection.execute("SELECT id, content FROM messages ORDER BY id"):
+                length += 1 + len(content)
+                if batch and length > max_length:
+                    break
+                batch.append((id, content))
+        return batch
+
+    def remove(self, batch):
+        """Removes the messages of a batch returned by `peek`, returns how many were still stored."""
+        with self._lock:
+            removed = self._connection.executemany(
+                "DELETE FROM messages WHERE id = ?", [(id,) for (id, _) in batch]
+            ).rowcount
+            self._count -= removed
+            return removed
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
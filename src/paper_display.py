@@ -0,0 +1,115 @@
+import time
+
+from tinkerforge.bricklet_e_paper_296x128 import BrickletEPaper296x128
+
+class PaperDisplay:
+    UID = "24KJ"
+
+    WIDTH = 296
+    HEIGHT = 128
+    LINE_HEIGHT = 16
+    # sensors beyond the lines that fit on the display are not shown, the first line starts one line down
+    MAX_LINES = HEIGHT // LINE_HEIGHT - 1
+
+    # a full refresh flickers for about 7.5 seconds, so it is done at most once per interval (in seconds)
+    MIN_FULL_REFRESH_INTERVAL = 60
+    # minimum time between any two refreshes (in seconds)
+    MIN_REFRESH_INTERVAL = 2
+    # delta refreshes leave ghosting behind, so clean up with a full refresh after this many
+    MAX_DELTA_REFRESHES = 30
+
+    def __init__(self, conn, uid=UID):
+        self.paper = BrickletEPaper296x128(uid, conn)
+
+        # (text, color) of every line as it was last drawn, None forces a full refresh
+        self._shown = None
+        self._update_mode = None
+        self._last_refresh = float("-inf")
+        self._last_full_refresh = float("-inf")
+        self._delta_refreshes = 0
+
+        self.full_refreshes = 0
+        self.delta_refreshes = 0
+        self.refreshes_skipped = 0
+
+    @property
+    def refreshes_performed(self):
+        return self.full_refreshes + self.delta_refreshes
+
+    def invalidate(self):
+        """Forgets what is shown on the display, so the next `render` does a full refresh."""
+        self._shown = None
+
+    def render(self, sensor_data):
+        """Refreshes the display if a shown value changed. Returns True if it was refreshed."""
+        paper = self.paper
+        lines = [
+            (f"{data.title}:{reading.current} {data.unit}",
+             paper.COLOR_RED if reading.is_critical else paper.COLOR_BLACK)
+            for (data, reading) in zip(sensor_data, sensor_data.snapshot())
+        ][:self.MAX_LINES]
+
+        if lines == self._shown:
+            return False
+
+        now = time.monotonic()
+        if now - self._last_refresh < self.MIN_REFRESH_INTERVAL or paper.get_draw_status() != paper.DRAW_STATUS_IDLE:
+            self.refreshes_skipped += 1
+            return False
+
+        if self._shown is None or len(self._shown) != len(lines):
+            changed = None
+        else:
+            changed = [i for (i, line) in enumerate(lines) if line != self._shown[i]]
+
+        # delta updates only touch black/white pixels, so red text needs a full refresh
+        needs_full = (
+            changed is None
+            or self._delta_refreshes >= self.MAX_DELTA_REFRESHES
+            or any(paper.COLOR_RED in (lines[i][1], self._shown[i][1]) for i in changed)
+        )
+
+        if needs_full:
+            if now - self._last_full_refresh < self.MIN_FULL_REFRESH_INTERVAL:
+                self.refreshes_skipped += 1
+                return False
+
+            paper.fill_display(paper.COLOR_WHITE)
+            for (i, line) in enumerate(lines):
+                self._draw_line(i, line)
+            self._set_update_mode(paper.UPDATE_MODE_DEFAULT)
+
+            self._last_full_refresh = now
+            self._delta_refreshes = 0
+            self.full_refreshes += 1
+        else:
+            for i in changed:
+                y = self._line_y(i)
+                paper.draw_box(0, y, self.WIDTH - 1, y + self.LINE_HEIGHT - 1, True, paper.COLOR_WHITE)
+                self._draw_line(i, lines[i])
+            self._set_update_mode(paper.UPDATE_MODE_DELTA)
+
+            self._delta_refreshes += 1
+            self.delta_refreshes += 1
+
+        paper.draw()
+        self._last_refresh = now
+        self._shown = lines
+        return True
+
+    def _draw_line(self, index, line):
+        (text, color) = line
+        self.paper.draw_text(
+            8, self._line_y(index),
+            self.paper.FONT_12X16,
+            color,
+            self.paper.ORIENTATION_HORIZONTAL,
+            text)
+
+    def _line_y(self, index):
+        return self.LINE_HEIGHT * (index + 1)
+
+    def _set_update_mode(self, update_mode):
+        if self._update_mode != update_mode:
+            self.paper.set_update_mode(update_mode)
+            self._update_mode = update_mode
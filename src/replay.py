@@ -0,0 +1,339 @@
+import collections
+import struct
+import threading
+import time
+
+from tinkerforge.ip_connection import IPConnection, get_function_id_from_data, get_uid_from_data, pack_payload, unpack_payload
+
+from metrics import MeteredIPConnection, function_name
+
+# a trace starts with this, followed by the records
+MAGIC = b"OBTRACE1"
+
+# kind, seconds since the start of the recording, device UID, function ID, payload length
+RECORD = struct.Struct("<BdIBH")
+CALLBACK = 0
+REQUEST = 1
+RESPONSE = 2
+
+HEADER = struct.Struct("<IBBBB")
+FUNCTION_GET_IDENTITY = 255
+
+class TraceWriter:
+    """Appends callbacks, requests and responses with their raw payload to a binary trace file."""
+
+    def __init__(self, path, clock=time.monotonic):
+        self._file = open(path, "wb")
+        self._file.write(MAGIC)
+        self._clock = clock
+        self._started = clock()
+        self._lock = threading.Lock()
+        self.records = 0
+
+    def write(self, kind, uid, function_id, payload):
+        record = RECORD.pack(kind, self._clock() - self._started, uid, function_id, len(payload)) + payload
+        with self._lock:
+            self._file.write(record)
+            self.records += 1
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+def read_trace(path):
+    """Yields the records of a trace as (kind, time, uid, function ID, payload)."""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a trace")
+        while True:
+            header = f.read(RECORD.size)
+            if len(header) < RECORD.size:
+                # a trace cut off by a crash ends with the last complete record
+                return
+            (kind, timestamp, uid, function_id, length) = RECORD.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length:
+                return
+            yield (kind, timestamp, uid, function_id, payload)
+
+class RecordingIPConnection(MeteredIPConnection):
+    """MeteredIPConnection which also writes every callback, request and response to a trace."""
+
+    def __init__(self, trace, **kwargs):
+        MeteredIPConnection.__init__(self, **kwargs)
+        self._trace = trace
+
+    def send_request(self, device, function_id, data, form, length_ret, form_ret):
+        self._trace.write(REQUEST, device.uid, function_id, pack_payload(data, form))
+        result = MeteredIPConnection.send_request(self, device, function_id, data, form, length_ret, form_ret)
+        if form_ret:
+            values = (result,) if len(form_ret.split(" ")) == 1 else result
+            self._trace.write(RESPONSE, device.uid, function_id, pack_payload(values, form_ret))
+        return result
+
+    def dispatch_packet(self, packet):
+        # runs on the callback thread
+        uid = get_uid_from_data(packet)
+        if uid in self.devices:
+            self._trace.write(CALLBACK, uid, get_function_id_from_data(packet), packet[8:])
+        return MeteredIPConnection.dispatch_packet(self, packet)
+
+class SimulatedClock:
+    """Clock which only advances when it is set, for the program logic during a replay."""
+
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+class ReplayConnection(IPConnection):
+    """IPConnection without brickd. Requests are recorded in `commands` and answered with the responses of the
+    trace in their order, or with zeros; callbacks are fed with `feed`."""
+
+    def __init__(self, clock, responses, commands):
+        IPConnection.__init__(self)
+        self._clock = clock
+        # payloads by (uid, function ID), shared by the connections of all hosts
+        self._responses = responses
+        self.commands = commands
+        self._state = IPConnection.CONNECTION_STATE_DISCONNECTED
+
+    def connect(self, host, port):
+        self._state = IPConnection.CONNECTION_STATE_CONNECTED
+        connected = self.registered_callbacks.get(IPConnection.CALLBACK_CONNECTED)
+        if connected is not None:
+            connected(IPConnection.CONNECT_REASON_REQUEST)
+
+    def disconnect(self):
+        self._state = IPConnection.CONNECTION_STATE_DISCONNECTED
+
+    def get_connection_state(self):
+        return self._state
+
+    def send_request(self, device, function_id, data, form, length_ret, form_ret):
+        if function_id == FUNCTION_GET_IDENTITY:
+            return [device.uid_string, "0", "a", (1, 0, 0), (2, 0, 0), device.DEVICE_IDENTIFIER]
+
+        self.commands.append((self._clock(), device, function_id, data, pack_payload(data, form)))
+        if not form_ret:
+            return None
+        responses = self._responses.get((device.uid, function_id))
+        payload = responses.popleft() if responses else bytes(length_ret - 8)
+        return unpack_payload(payload, form_ret)
+
+    def feed(self, uid, function_id, payload):
+        """Delivers a callback as if brickd had sent it."""
+        self.dispatch_packet(HEADER.pack(uid, 8 + len(payload), function_id, 0, 0) + payload)
+
+class Replayer:
+    """Feeds the callbacks of a trace into the alarm logic, sensors and alerts as `main.py` wires them, on a
+    simulated clock.
+
+    `speed` is the factor of the recorded pace, 1 replays in real time and 0 as fast as possible. The decisions,
+    every command sent to a bricklet and every alert message, are collected in `decisions`.
+    """
+
+    # the periodic jobs of main.py (in seconds)
+    ALERT_INTERVAL = 1
+    # responses are loaded this far (in seconds) ahead of the callbacks, since a handler may request them before
+    # the recorded response would be reached
+    RESPONSE_HORIZON = 1
+
+    def __init__(self, config, speed=0):
+        # only needed to replay, not by main.py which records
+        from alarm import Alarm
+        from alerts import AlertEngine, rules_from_config
+        from count_down import CountDown
+        from devices import DeviceRegistry
+        from events import EventBus
+        from motion_detection import MotionDetection
+        from nfc_reader import NfcReader
+        from sensor_data import SensorData
+
+        self.speed = speed
+        self.clock = SimulatedClock()
+        self.responses = collections.defaultdict(collections.deque)
+        self.commands = []
+        self.alerts = []
+        self._connections = []
+
+        def connection(host):
+            connection = ReplayConnection(self.clock, self.responses, self.commands)
+            self._connections.append(connection)
+            return connection
+
+        self.events = EventBus(clock=self.clock)
+        self.registry = DeviceRegistry(config, connection, self.events, self.clock)
+        self.sensor_data = SensorData(self.clock)
+        self.registry.add_sensors(self.sensor_data)
+
+        registry = self.registry
+        self.count_down = CountDown(registry.connection("segment_display"), registry.uid("segment_display"), self.events)
+        self.alarm = Alarm(registry.connection("speaker"), self.count_down, 1, registry.uid("speaker"), registry.uid("button"),
+                           button_conn=registry.connection("button"), events=self.events, clock=self.clock)
+        self.nfc_reader = NfcReader(registry.connection("nfc"), self.count_down, self.alarm, registry.uid("nfc"),
+                                    config["devices"]["nfc"].get("whitelist", NfcReader.WHITELIST_PATH), self.events,
+                                    legacy_suffixes=config["devices"]["nfc"].get("legacy_suffixes", False))
+        self.motion_detection = MotionDetection(registry.connection("motion"), self.count_down, self.alarm,
+                                                registry.uid("motion"), self.events)
+        self.alert_engine = AlertEngine(rules_from_config(config, self.sensor_data),
+                                        lambda message: self.alerts.append((self.clock(), message)), clock=self.clock)
+        self.sensor_data.subscribe(self.alert_engine.on_reading)
+
+        for (role, setup) in (("button", self.alarm.setup), ("speaker", self.alarm.setup_speaker),
+                              ("segment_display", self.count_down.setup), ("nfc", self.nfc_reader.setup),
+                              ("motion", self.motion_detection.setup)):
+            registry.on_connected(role, setup)
+
+        self.callbacks = 0
+        # simulated time when the next held back event and the next alert tick are due
+        self._event_due = None
+        self._alert_due = None
+
+    def run(self, records):
+        """Replays the records, returns the simulated seconds."""
+        records = iter(records)
+        first = next(records, None)
+        if first is None:
+            return 0.0
+
+        origin = first[1]
+        self.clock.now = origin
+        self.registry.connect()
+        self._alert_due = origin + self.ALERT_INTERVAL
+        connections = {uid: connection for connection in self._connections for uid in connection.devices}
+        started = time.perf_counter()
+
+        for (kind, timestamp, uid, function_id, payload) in self._callbacks(_chain(first, records), connections):
+            connection = connections[uid]
+
+            if self.speed:
+                delay = (timestamp - origin) / self.speed - (time.perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+
+            self._run_until(timestamp)
+            connection.feed(uid, function_id, payload)
+            self._advance(timestamp)
+            self.callbacks += 1
+
+        # let the last events and alerts pass
+        self._run_until(self.clock.now + 1)
+        self.alert_engine.flush()
+        return self.clock.now - origin
+
+    def _callbacks(self, records, connections):
+        """The callbacks of the replayed devices, while their responses are loaded ahead."""
+        ahead = collections.deque()
+        for record in records:
+            (kind, timestamp, uid, function_id, payload) = record
+            if uid not in connections:
+                # e.g. the displays, which aren't part of the replay
+                continue
+            if kind == RESPONSE and function_id != FUNCTION_GET_IDENTITY:
+                # answers a request the program makes for a callback, like reading the NFC tag ID
+                self.responses[(uid, function_id)].append(payload)
+            elif kind == CALLBACK:
+                ahead.append(record)
+            while ahead and ahead[0][1] < timestamp - self.RESPONSE_HORIZON:
+                yield ahead.popleft()
+        yield from ahead
+
+    def _run_until(self, until):
+        """Advances the clock to `until`, handling the events and alert ticks due meanwhile in order."""
+        while True:
+            due = self._alert_due if self._event_due is None else min(self._event_due, self._alert_due)
+            if due > until:
+                break
+            self._advance(due)
+            if due == self._alert_due:
+                self.alert_engine.tick()
+                self._alert_due += self.ALERT_INTERVAL
+        self._advance(until)
+
+    def _advance(self, now):
+        self.clock.now = now
+        self._event_due = self.events.step()
+        # main.py flushes the button colors every 0.1 s, here after every handled event
+        self.alarm.update()
+
+    @property
+    def decisions(self):
+        """Commands and alerts as (time, text), ordered by time."""
+        commands = [(round(timestamp, 3), f"{device.uid_string}.{function_name(device, function_id)}{tuple(data)}")
+                    for (timestamp, device, function_id, data, _) in self.commands]
+        alerts = [(round(timestamp, 3), f"alert: {message}") for (timestamp, message) in self.alerts]
+        return sorted(commands + alerts, key=lambda decision: decision[0])
+
+    def differences(self, records):
+        """Compares the commands with the requests recorded in the trace, per device since commands of different
+        threads may interleave differently. Returns a description of the first difference of every device."""
+        recorded = collections.defaultdict(list)
+        replayed = collections.defaultdict(list)
+        names = {}
+        for (timestamp, device, function_id, _, payload) in self.commands:
+            replayed[device.uid].append((function_id, payload))
+            names[device.uid] = device
+        for (kind, timestamp, uid, function_id, payload) in records:
+            if kind == REQUEST and function_id != FUNCTION_GET_IDENTITY and uid in names:
+                recorded[uid].append((function_id, payload))
+
+        differences = []
+        for (uid, device) in names.items():
+            (got, wanted) = (replayed[uid], recorded[uid])
+            for index in range(max(len(got), len(wanted))):
+                if index >= len(got) or index >= len(wanted) or got[index] != wanted[index]:
+                    describe = lambda command: f"{function_name(device, command[0])}({command[1].hex()})" if command else "nothing"
+                    differences.append(f"{device.uid_string} request {index}: recorded {describe(wanted[index] if index < len(wanted) else None)}, "
+                                       f"replayed {describe(got[index] if index < len(got) else None)}")
+                    break
+        return differences
+
+def _chain(first, rest):
+    yield first
+    yield from rest
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    from devices import load_config
+
+    parser = argparse.ArgumentParser(description="Replays a trace recorded with OBSERVER_TRACE through the alarm logic and alerts")
+    parser.add_argument("trace")
+    parser.add_argument("--speed", type=float, default=0, help="factor of the recorded pace, 0 as fast as possible (default)")
+    parser.add_argument("--config", help="config file, the one of the program by default")
+    parser.add_argument("--save", metavar="PATH", help="write the decisions as expected result to a JSON file")
+    parser.add_argument("--expect", metavar="PATH", help="compare the decisions with a saved result")
+    args = parser.parse_args()
+
+    replayer = Replayer(load_config(args.config), args.speed)
+    started = time.perf_counter()
+    simulated = replayer.run(read_trace(args.trace))
+    elapsed = time.perf_counter() - started
+    decisions = replayer.decisions
+
+    print(f"{replayer.callbacks} callbacks over {simulated:.1f} s replayed in {elapsed:.2f} s "
+          f"({simulated / elapsed if elapsed else float('inf'):.0f}x, {replayer.callbacks / elapsed if elapsed else 0:.0f} callbacks/s)")
+    print(f"{len(replayer.commands)} commands, {len(replayer.alerts)} alert messages, "
+          f"{replayer.events.coalesced} events coalesced")
+
+    differences = replayer.differences(read_trace(args.trace))
+    print(f"requests as recorded: {'yes' if not differences else 'no'}")
+    for difference in differences:
+        print(f"  {difference}")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(decisions, f, indent=1)
+    if args.expect:
+        with open(args.expect) as f:
+            expected = [tuple(decision) for decision in json.load(f)]
+        if expected != decisions:
+            for (index, (got, wanted)) in enumerate(zip(decisions + [None] * len(expected), expected + [None] * len(decisions))):
+                if got != wanted:
+                    print(f"REGRESSION at decision {index}: expected {wanted}, got {got}")
+                    break
+            raise SystemExit(1)
+        print(f"all {len(decisions)} decisions as expected")
@@ -0,0 +1,84 @@
+import time
+
+from tinkerforge.ip_connection import Error
+
+SLOW = "slow"
+FAST = "fast"
+
+class AdaptiveSampler:
+    """Switches the callback configuration of a sensor between slow sampling, which only reports changed values,
+    while it is stable, and fast sampling while it is near or beyond a critical bound of its statistics.
+
+    `configure` is the `set_*_callback_configuration` function of the bricklet, periods are in ms. Fast sampling
+    ends after the value stayed more than `margin` away from the bounds for `calm_time` seconds.
+    """
+
+    def __init__(self, statistics, configure, divisor, slow_period=5000, fast_period=250, margin=0, calm_time=30,
+                 baseline_period=1000, clock=time.monotonic):
+        self.statistics = statistics
+        self._configure = configure
+        self._divisor = divisor
+        self.slow_period = slow_period
+        self.fast_period = fast_period
+        self.margin = margin
+        self.calm_time = calm_time
+        # period of the fixed sampling the savings are compared to
+        self.baseline_period = baseline_period
+
+        self._clock = clock
+        self.mode = SLOW
+        self._calm_since = None
+
+        self.callbacks = 0
+        self.switches = 0
+        self._started = clock()
+
+    def setup(self):
+        """Configures the bricklet for the current mode, on every (re)connect."""
+        self._apply(self.mode)
+
+    def on_value(self, raw):
+        # runs on the callback thread
+        value = raw / self._divisor
+        self.statistics.set_current(value)
+        self.callbacks += 1
+
+        if self.statistics.is_critical or self._near(value):
+            self._calm_since = None
+            if self.mode != FAST:
+                self._switch(FAST)
+        elif self.mode == FAST:
+            now = self._clock()
+            if self._calm_since is None:
+                self._calm_since = now
+            elif now - self._calm_since >= self.calm_time:
+                self._switch(SLOW)
+
+    def _near(self, value):
+        statistics = self.statistics
+        return (
+            statistics.critical_min is not None and value < statistics.critical_min + self.margin
+        ) or (
+            statistics.critical_max is not None and value > statistics.critical_max - self.margin
+        )
+
+    def _switch(self, mode):
+        self.switches += 1
+        self._apply(mode)
+
+    def _apply(self, mode):
+        self.mode = mode
+        try:
+            if mode == FAST:
+                self._configure(self.fast_period, False, "x", 0, 0)
+            else:
+                self._configure(self.slow_period, True, "x", 0, 0)
+        except Error as e:
+            print(f"Configuring the sampling of {self.statistics.title} failed: {e}")
+
+    def saved_per_second(self):
+        """Callbacks per second saved compared to fixed sampling with `baseline_period`."""
+        elapsed = self._clock() - self._started
+        if elapsed <= 0:
+            return 0.0
+        return (elapsed * 1000 / self.baseline_period - self.callbacks) / elapsed
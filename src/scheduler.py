@@ -0,0 +1,95 @@
+import asyncio
+import traceback
+
+from metrics import METRICS
+
+# the event loop lag is sampled with this interval (in seconds)
+LAG_INTERVAL = 0.1
+
+class Job:
+    def __init__(self, name, function, interval, events, min_interval):
+        self.name = name
+        self.function = function
+        self.interval = interval
+        self.events = events
+        self.min_interval = min_interval
+
+        self.runs = 0
+        self.last_run = float("-inf")
+        self.labels = (("job", name),)
+        # created in the event loop by `Scheduler.run`
+        self.wake = None
+
+class Scheduler:
+    """Runs blocking jobs concurrently, each on its own cadence or when one of its events is notified.
+
+    Jobs run in worker threads, so a slow job (e.g. a bricklet RPC) doesn't delay the others.
+    """
+
+    def __init__(self):
+        self._jobs = []
+        self._loop = None
+
+    def add(self, name, function, interval=None, events=(), min_interval=0):
+        """Runs `function` every `interval` seconds (never if None) and whenever one of `events` is notified,
+        but not more often than every `min_interval` seconds."""
+        self._jobs.append(Job(name, function, interval, tuple(events), min_interval))
+
+    def notify(self, event):
+        """Wakes every job waiting for `event`. Safe to call from any thread, e.g. a bricklet callback."""
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._wake, event)
+
+    def _wake(self, event):
+        for job in self._jobs:
+            if event in job.events:
+                job.wake.set()
+
+    async def _run_job(self, job):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await asyncio.wait_for(job.wake.wait(), job.interval)
+            except TimeoutError:
+                pass
+            job.wake.clear()
+
+            delay = job.last_run + job.min_interval - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            job.last_run = loop.time()
+            try:
+                with METRICS.time("job_seconds", job.labels):
+                    await asyncio.to_thread(job.function)
+            except Exception:
+                print(f"Job {job.name} failed:")
+                traceback.print_exc()
+            job.runs += 1
+
+    async def _measure_lag(self):
+        """Records how late the event loop wakes up, which delays every job."""
+        loop = asyncio.get_running_loop()
+        while True:
+            before = loop.time()
+            await asyncio.sleep(LAG_INTERVAL)
+            METRICS.observe("loop_lag_seconds", loop.time() - before - LAG_INTERVAL)
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        for job in self._jobs:
+            job.wake = asyncio.Event()
+            # run everything once at startup
+            job.wake.set()
+
+        try:
+            async with asyncio.TaskGroup() as group:
+                for job in self._jobs:
+                    group.create_task(self._run_job(job), name=job.name)
+                group.create_task(self._measure_lag(), name="lag")
+        finally:
+            self._loop = None
+
+    def run_forever(self):
+        asyncio.run(self.run())
@@ -0,0 +1,189 @@
+import threading
+import time
+import traceback
+
+from streaming_stats import CriticalState, StreamingStatistics
+
+class Reading:
+    """State of one sensor. Never modified, a new reading replaces the old one on every update."""
+    __slots__ = ("current", "minimum", "maximum", "is_critical",
+                 "mean", "stddev", "ewma", "window_minimum", "window_maximum", "median", "p95")
+
+    def __init__(self, current, minimum, maximum, is_critical, stats=None):
+        self.current = current
+        self.minimum = minimum
+        self.maximum = maximum
+        self.is_critical = is_critical
+
+        # statistics over the rolling window
+        if stats is None:
+            (self.mean, self.stddev, self.ewma, self.window_minimum, self.window_maximum, self.median, self.p95) = (None,) * 7
+        else:
+            self.mean = stats.window.mean
+            self.stddev = stats.window.stddev
+            self.ewma = stats.ewma.value
+            self.window_minimum = stats.extremes.minimum
+            self.window_maximum = stats.extremes.maximum
+            self.median = stats.quantile(0.5)
+            self.p95 = stats.quantile(0.95)
+
+class Statistics:
+    __slots__ = ("title", "unit", "critical_min", "critical_max",
+                 "_reading", "_stats", "_critical", "_store", "_lock", "_clock")
+
+    def __init__(self, title, unit, min, max, critical_min=None, critical_max=None, window=60, hysteresis=0, min_duration=0,
+                 clock=time.monotonic):
+        """`window` is the number of readings of the rolling statistics. A critical state is left only after the
+        value is `hysteresis` back inside the bounds, and a state change needs to last `min_duration` seconds of
+        `clock`, which is replaced by the clock of the SensorData it is added to."""
+        self.title = title
+        self.unit = unit
+
+        self.critical_min = critical_min
+        self.critical_max = critical_max
+
+        self._reading = Reading(None, max, min, False)
+        self._stats = StreamingStatistics(window)
+        self._critical = CriticalState(hysteresis, min_duration)
+        self._clock = clock
+
+        # set when added to a SensorData
+        self._store = None
+        self._lock = threading.Lock()
+
+    def set_current(self, value):
+        with self._lock:
+            self._stats.add(value)
+
+            reading = self._reading
+            reading = Reading(
+                value,
+                min(reading.minimum, value),
+                max(reading.maximum, value),
+                self._critical.update(value, self._clock(), self.critical_min, self.critical_max),
+                self._stats)
+
+            # publishing is a single reference assignment, so readers never see a half updated reading
+            if self._store is not None:
+                self._store._publish(self, reading)
+            else:
+                self._reading = reading
+
+        if self._store is not None:
+            # a failing listener must not keep the others, e.g. the alerts, from seeing the reading
+            for listener in self._store._listeners:
+                try:
+                    listener(self, reading)
+                except Exception:
+                    print(f"Listener of {self.title} failed:")
+                    traceback.print_exc()
+
+    def get_current(self):
+        return self._reading.current
+
+    def get_reading(self):
+        return self._reading
+
+    @property
+    def is_critical(self):
+        return self._reading.is_critical
+
+    @property
+    def measured_minimum(self):
+        return self._reading.minimum
+
+    @property
+    def measured_maximum(self):
+        return self._reading.maximum
+
+    def __str__(self):
+        reading = self._reading
+        return f"""
+        {self.title}
+        current: {reading.current}{self.unit}
+        minimum: {reading.minimum}{self.unit}
+        maximum: {reading.maximum}{self.unit}
+        """.strip()
+
+# settings of the statistics per sensor type
+SENSOR_TYPES = {
+    "temperature": {"title": "TEMPERATURE", "unit": "C", "min": 0, "max": 80},
+    "illuminance": {"title": "ILLUMINANCE", "unit": "lx", "min": 0, "max": 1600, "critical_min": 50, "hysteresis": 5, "min_duration": 3},
+    "moisture": {"title": "MOISTURE", "unit": "%RH", "min": 0, "max": 100},
+}
+
+# a reader builds the snapshot at most this often while writers interfere, then it waits for them once
+SNAPSHOT_ATTEMPTS = 10
+
+# used as global state
+class SensorData:
+    def __init__(self, clock=time.monotonic):
+        # serializes writers, readers wait only if writers keep interfering with building a snapshot
+        self._lock = threading.Lock()
+        # times the critical states of all sensors, e.g. a simulated clock when replaying a trace
+        self._clock = clock
+        self._sensors = ()
+        self._listeners = ()
+        # incremented after every change, so a reader can tell whether a snapshot it built is still consistent
+        self._version = 0
+        # (version, readings) of the last snapshot built, reused by readers until the next change
+        self._cached = (0, ())
+
+        self.temperature = self.add(Statistics(**SENSOR_TYPES["temperature"]))
+        self.illuminance = self.add(Statistics(**SENSOR_TYPES["illuminance"]))
+        self.moisture = self.add(Statistics(**SENSOR_TYPES["moisture"]))
+
+    def add(self, statistics):
+        with self._lock:
+            statistics._store = self
+            statistics._lock = self._lock
+            statistics._clock = self._clock
+
+            self._sensors += (statistics,)
+            self._version += 1
+
+        return statistics
+
+    def subscribe(self, listener):
+        """Calls `listener(statistics, reading)` after every update, on the thread which set the value."""
+        with self._lock:
+            self._listeners += (listener,)
+
+    def _publish(self, statistics, reading):
+        # called with the lock held; costs the same for any number of sensors, the snapshot is built by readers
+        statistics._reading = reading
+        self._version += 1
+
+    def snapshot(self):
+        """Returns a consistent tuple with the readings of all sensors, in the order they were added.
+
+        The tuple is built by the first reader after a change and shared by all readers until the next one.
+        """
+        (version, snapshot) = self._cached
+        if version == self._version:
+            return snapshot
+
+        for _ in range(SNAPSHOT_ATTEMPTS):
+            version = self._version
+            snapshot = tuple([statistics._reading for statistics in self._sensors])
+            # unchanged version: no reading was replaced while the tuple was built, so it shows a single moment
+            if self._version == version:
+                self._cached = (version, snapshot)
+                return snapshot
+
+        with self._lock:
+            snapshot = tuple([statistics._reading for statistics in self._sensors])
+            self._cached = (self._version, snapshot)
+            return snapshot
+
+    def __iter__(self):
+        return iter(self._sensors)
+
+    def __len__(self):
+        return len(self._sensors)
+
+    def __getitem__(self, idx):
+        return self._sensors[idx]
+
+    def __str__(self):
+        return "\n".join([str(data) for data in self])
@@ -0,0 +1,158 @@
+import math
+from bisect import bisect_left, insort
+from collections import deque
+
+class RollingWindow:
+    """Mean and variance of the last `size` values, updated in O(1) per value."""
+
+    def __init__(self, size):
+        self._values = deque(maxlen=size)
+        self.mean = 0.0
+        # sum of squared differences from the mean
+        self._m2 = 0.0
+
+    def add(self, value):
+        values = self._values
+        if len(values) == values.maxlen:
+            oldest = values[0]
+            values.append(value)
+            previous_mean = self.mean
+            self.mean += (value - oldest) / len(values)
+            self._m2 += (value - oldest) * (value - self.mean + oldest - previous_mean)
+        else:
+            values.append(value)
+            delta = value - self.mean
+            self.mean += delta / len(values)
+            self._m2 += delta * (value - self.mean)
+
+    def __len__(self):
+        return len(self._values)
+
+    @property
+    def variance(self):
+        return max(self._m2, 0.0) / len(self._values) if self._values else 0.0
+
+    @property
+    def stddev(self):
+        return math.sqrt(self.variance)
+
+class Ewma:
+    """Exponentially weighted moving average."""
+
+    def __init__(self, alpha):
+        self.alpha = alpha
+        self.value = None
+
+    def add(self, value):
+        self.value = value if self.value is None else self.value + self.alpha * (value - self.value)
+
+class WindowedExtremes:
+    """Minimum and maximum of the last `size` values using monotonic deques, amortized O(1) per value."""
+
+    def __init__(self, size):
+        self._size = size
+        self._count = 0
+        # (index, value) with increasing values for the minimum and decreasing values for the maximum
+        self._minimums = deque()
+        self._maximums = deque()
+
+    def add(self, value):
+        index = self._count
+        self._count += 1
+
+        minimums = self._minimums
+        while minimums and minimums[-1][1] >= value:
+            minimums.pop()
+        minimums.append((index, value))
+        if minimums[0][0] <= index - self._size:
+            minimums.popleft()
+
+        maximums = self._maximums
+        while maximums and maximums[-1][1] <= value:
+            maximums.pop()
+        maximums.append((index, value))
+        if maximums[0][0] <= index - self._size:
+            maximums.popleft()
+
+    @property
+    def minimum(self):
+        return self._minimums[0][1] if self._minimums else None
+
+    @property
+    def maximum(self):
+        return self._maximums[0][1] if self._maximums else None
+
+class WindowedQuantiles:
+    """Exact quantiles of the last `size` values, kept sorted with bisection.
+
+    Inserting and removing shift at most `size` references, which for windows of a few hundred values is cheaper
+    in Python than an approximating algorithm.
+    """
+
+    def __init__(self, size):
+        self._values = deque(maxlen=size)
+        self._sorted = []
+
+    def add(self, value):
+        values = self._values
+        if len(values) == values.maxlen:
+            del self._sorted[bisect_left(self._sorted, values[0])]
+        values.append(value)
+        insort(self._sorted, value)
+
+    def quantile(self, p):
+        """The value below which a fraction `p` of the window lies, None while it is empty."""
+        ordered = self._sorted
+        if not ordered:
+            return None
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+class CriticalState:
+    """Decides whether a value is critical.
+
+    A critical value has to get back `hysteresis` inside the bounds before it is normal again, and a change
+    only takes effect if the new state lasts for `min_duration` seconds.
+    """
+
+    def __init__(self, hysteresis=0, min_duration=0):
+        self.hysteresis = hysteresis
+        self.min_duration = min_duration
+        self.is_critical = False
+        # time since the opposite state holds
+        self._since = None
+
+    def update(self, value, now, critical_min, critical_max):
+        margin = self.hysteresis if self.is_critical else 0
+        outside = (
+            critical_min is not None and value < critical_min + margin
+        ) or (
+            critical_max is not None and value > critical_max - margin
+        )
+
+        if outside == self.is_critical:
+            self._since = None
+        elif self._since is None and self.min_duration > 0:
+            self._since = now
+        elif self._since is None or now - self._since >= self.min_duration:
+            self.is_critical = outside
+            self._since = None
+
+        return self.is_critical
+
+class StreamingStatistics:
+    """Combines the rolling statistics of one sensor."""
+
+    def __init__(self, window=60, ewma_alpha=0.1):
+        self.window = RollingWindow(window)
+        self.extremes = WindowedExtremes(window)
+        self.ewma = Ewma(ewma_alpha)
+        self.quantiles = WindowedQuantiles(window)
+
+    def add(self, value):
+        self.window.add(value)
+        self.extremes.add(value)
+        self.ewma.add(value)
+        self.quantiles.add(value)
+
+    def quantile(self, p):
+        return self.quantiles.quantile(p)
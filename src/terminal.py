@@ -0,0 +1,47 @@
+import os
+import sys
+
+class TerminalRenderer:
+    """Shows a block of text at the top of the terminal, rewriting only the lines that changed."""
+
+    def __init__(self, stream=sys.stdout):
+        self._stream = stream
+        self._lines = None
+
+        if os.name == "nt":
+            _enable_virtual_terminal()
+
+    def render(self, text):
+        lines = text.splitlines()
+        output = []
+
+        if self._lines is None:
+            # clear the screen once
+            output.append("\x1b[2J")
+            self._lines = []
+
+        for (i, line) in enumerate(lines):
+            if i >= len(self._lines) or self._lines[i] != line:
+                output.append(f"\x1b[{i + 1};1H{line}\x1b[K")
+
+        for i in range(len(lines), len(self._lines)):
+            output.append(f"\x1b[{i + 1};1H\x1b[K")
+
+        if output:
+            # leave the cursor below the block for other output
+            output.append(f"\x1b[{len(lines) + 1};1H")
+            self._stream.write("".join(output))
+            self._stream.flush()
+
+        self._lines = lines
+
+def _enable_virtual_terminal():
+    """Enables ANSI escape sequences in the windows console."""
+    import ctypes
+
+    ENABLE_VIRTUAL_TERMINAL_PROCESSING = 0x0004
+    kernel32 = ctypes.windll.kernel32
+    handle = kernel32.GetStdHandle(-11)
+    mode = ctypes.c_uint32()
+    if kernel32.GetConsoleMode(handle, ctypes.byref(mode)):
+        kernel32.SetConsoleMode(handle, mode.value | ENABLE_VIRTUAL_TERMINAL_PROCESSING)
@@ -0,0 +1,308 @@
+import itertools
+import mmap
+import os
+import struct
+import threading
+import time
+
+class RecordFile:
+    """Ring of fixed-size records in a memory-mapped file, oldest records are overwritten first.
+
+    Records have to be appended in time order and start with a float64 timestamp.
+    """
+
+    MAGIC = b"OBSTS\x00\x00\x01"
+    HEADER_SIZE = 512
+    # the comma separated names take the rest of the header, older files have zeros after their 256 bytes
+    NAMES_SIZE = HEADER_SIZE - struct.calcsize("<8sHHQQQ")
+    HEADER = struct.Struct(f"<8sHHQQQ{NAMES_SIZE}s")
+    # count and next index within the header, updated on every append
+    COUNTERS = struct.Struct("<QQ")
+    COUNTERS_OFFSET = 20
+    # the first record starts right after the header
+    assert HEADER.size <= HEADER_SIZE
+
+    def __init__(self, path, record, size):
+        self.record = record
+        capacity = max(1, (size - self.HEADER_SIZE) // record.size)
+
+        exists = os.path.exists(path) and os.path.getsize(path) >= self.HEADER_SIZE
+        self._file = open(path, "r+b" if exists else "w+b")
+
+        if exists:
+            header = self._file.read(self.HEADER.size)
+            (magic, _version, record_size, capacity, count, next, names) = self.HEADER.unpack(header)
+            if magic != self.MAGIC or record_size != record.size:
+                raise ValueError(f"{path} is not a time-series file with {record.size} byte records")
+        else:
+            (count, next, names) = (0, 0, b"")
+
+        self.capacity = capacity
+        self.count = count
+        self._next = next
+        self.names = [name for name in names.rstrip(b"\0").decode().split(",") if name]
+
+        # preallocate the whole file once, later writes only touch the mapping
+        length = self.HEADER_SIZE + capacity * record.size
+        self._file.truncate(length)
+        self._map = mmap.mmap(self._file.fileno(), length)
+        self._write_header()
+
+    def _write_header(self):
+        self.HEADER.pack_into(self._map, 0, self.MAGIC, 1, self.record.size, self.capacity, self.count, self._next,
+                              ",".join(self.names).encode())
+
+    def _write_counters(self):
+        self.COUNTERS.pack_into(self._map, self.COUNTERS_OFFSET, self.count, self._next)
+
+    def _offset(self, index):
+        """File offset of the index-th record, 0 being the oldest one."""
+        return self.HEADER_SIZE + (self._next - self.count + index) % self.capacity * self.record.size
+
+    def append(self, *values):
+        self.record.pack_into(self._map, self.HEADER_SIZE + self._next * self.record.size, *values)
+        self._next = (self._next + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        self._write_counters()
+
+    def __getitem__(self, index):
+        return self.record.unpack_from(self._map, self._offset(index))
+
+    def reversed(self, chunk=4096):
+        """Yields the records from the newest to the oldest one, unpacking contiguous chunks of the ring at once."""
+        end = self.count
+        while end > 0:
+            # a chunk never wraps around the end of the ring
+            start = max(end - chunk, 0, end - 1 - (self._next - self.count + end - 1) % self.capacity)
+            offset = self._offset(start)
+            records = list(self.record.iter_unpack(self._map[offset:offset + (end - start) * self.record.size]))
+            yield from reversed(records)
+            end = start
+
+    def timestamp(self, index):
+        return struct.unpack_from("<d", self._map, self._offset(index))[0]
+
+    def bisect(self, timestamp):
+        """Index of the first record not older than `timestamp`."""
+        (low, high) = (0, self.count)
+        while low < high:
+            middle = (low + high) // 2
+            if self.timestamp(middle) < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def range(self, start, end):
+        """Yields the records with start <= timestamp < end."""
+        for index in range(self.bisect(start), self.count):
+            record = self[index]
+            if record[0] >= end:
+                return
+            yield record
+
+    def pop(self):
+        """Removes and returns the newest record."""
+        record = self[self.count - 1]
+        self._next = (self._next - 1) % self.capacity
+        self.count -= 1
+        self._write_counters()
+        return record
+
+    def trim(self, before):
+        """Drops all records older than `before`."""
+        dropped = self.bisect(before)
+        if dropped:
+            self.count -= dropped
+            self._write_counters()
+
+    def set_names(self, names):
+        """Stores the names in the header, raises ValueError without changing anything if they don't fit."""
+        # struct would silently cut them, and the records of the cut names would be attributed to other sensors
+        length = len(",".join(names).encode())
+        if length > self.NAMES_SIZE:
+            raise ValueError(f"{self._file.name}: the names take {length} bytes, at most {self.NAMES_SIZE} fit into the header")
+        self.names = list(names)
+        self._write_header()
+
+    def flush(self):
+        self._map.flush()
+
+    def close(self):
+        self._map.flush()
+        self._map.close()
+        self._file.close()
+
+class TimeSeriesLog:
+    """Append-only log of all sensor readings with minute and hour rollups.
+
+    Every resolution is a ring in its own file, so the size on disk is bounded. Records older than `max_age`
+    seconds are dropped as well. The rollups still being collected are written by `close` and continued after a
+    restart.
+    """
+
+    # timestamp, sensor id, value
+    RAW = struct.Struct("<dHf")
+    # bucket start, sensor id, count, minimum, maximum, sum
+    AGGREGATE = struct.Struct("<dHIffd")
+
+    RESOLUTIONS = {"minute": 60, "hour": 60 * 60}
+
+    # records searched by `latest` at most, about an hour of readings of a dozen sensors every 250 ms
+    LATEST_LIMIT = 200000
+
+    def __init__(self, path, raw_size=32 * 1024 * 1024, minute_size=4 * 1024 * 1024, hour_size=1024 * 1024, max_age=None):
+        self._lock = threading.Lock()
+        self.max_age = max_age
+
+        self._files = {
+            "raw": RecordFile(f"{path}.raw.bin", self.RAW, raw_size),
+            "minute": RecordFile(f"{path}.minute.bin", self.AGGREGATE, minute_size),
+            "hour": RecordFile(f"{path}.hour.bin", self.AGGREGATE, hour_size),
+        }
+
+        # the raw file holds the names of the sensor ids
+        self._names = list(self._files["raw"].names)
+        self._ids = {name: id for (id, name) in enumerate(self._names)}
+
+        # aggregates which are still collected: resolution -> sensor id -> [start, count, minimum, maximum, sum]
+        self._buckets = {resolution: {} for resolution in self.RESOLUTIONS}
+        # `close` writes the rollups still being collected last, so the newest record of every sensor is taken back
+        # and continued; a bucket whose time is over is written again as it was, the others get no second record
+        for (resolution, buckets) in self._buckets.items():
+            file = self._files[resolution]
+            while file.count and file[file.count - 1][1] not in buckets:
+                (start, id, *values) = file.pop()
+                buckets[id] = [start, *values]
+
+    def sensor_id(self, name):
+        id = self._ids.get(name)
+        if id is None:
+            with self._lock:
+                id = self._ids.get(name)
+                if id is None:
+                    # raises before the id is taken if the name doesn't fit into the file any more
+                    self._files["raw"].set_names(self._names + [name])
+                    id = len(self._names)
+                    self._names.append(name)
+                    self._ids[name] = id
+        return id
+
+    def append(self, name, value, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        id = self.sensor_id(name)
+
+        with self._lock:
+            self._files["raw"].append(timestamp, id, value)
+
+            for (resolution, length) in self.RESOLUTIONS.items():
+                start = timestamp - timestamp % length
+                bucket = self._buckets[resolution].get(id)
+
+                if bucket is not None and bucket[0] != start:
+                    self._files[resolution].append(bucket[0], id, *bucket[1:])
+                    bucket = None
+                    if resolution == "minute" and self.max_age is not None:
+                        # once a minute is often enough to enforce the age limit
+                        for file in self._files.values():
+                            file.trim(timestamp - self.max_age)
+
+                if bucket is None:
+                    self._buckets[resolution][id] = [start, 1, value, value, value]
+                else:
+                    bucket[1] += 1
+                    bucket[2] = min(bucket[2], value)
+                    bucket[3] = max(bucket[3], value)
+                    bucket[4] += value
+
+    def query(self, name, start=0.0, end=float("inf"), resolution="raw"):
+        """Returns (timestamp, value) tuples for raw data and (start, count, minimum, maximum, mean) for rollups."""
+        id = self._ids.get(name)
+        if id is None:
+            return []
+
+        with self._lock:
+            records = [record for record in self._files[resolution].range(start, end) if record[1] == id]
+
+            # include the rollup that is still collected
+            bucket = self._buckets.get(resolution, {}).get(id)
+            if bucket is not None and start <= bucket[0] < end:
+                records.append((bucket[0], id, *bucket[1:]))
+
+        if resolution == "raw":
+            return [(timestamp, value) for (timestamp, _, value) in records]
+        return [(timestamp, count, minimum, maximum, total / count) for (timestamp, _, count, minimum, maximum, total) in records]
+
+    def latest(self, name, count, limit=None):
+        """Returns the values of the last `count` raw readings of a sensor, oldest first.
+
+        Only the newest `limit` records of all sensors are searched, so a rarely logged sensor may get fewer.
+        """
+        id = self._ids.get(name)
+        if id is None:
+            return []
+
+        values = []
+        with self._lock:
+            for (_, record_id, value) in itertools.islice(self._files["raw"].reversed(), limit or self.LATEST_LIMIT):
+                if record_id == id:
+                    values.append(value)
+                    if len(values) == count:
+                        break
+
+        values.reverse()
+        return values
+
+    def resample(self, name, end, interval, count):
+        """Returns the values of a sensor at `count` ticks `interval` seconds apart up to `end`, oldest first.
+
+        Every tick gets the last reading before it, like a graph sampling the current value. Only readings within
+        the ticks are used, so ticks before the first of them are left out instead of spanning a gap in the log.
+        """
+        start = end - interval * (count - 1)
+        readings = self.query(name, start, end)
+
+        values = []
+        (index, value) = (0, None)
+        for tick in range(count):
+            while index < len(readings) and readings[index][0] <= start + tick * interval:
+                value = readings[index][1]
+                index += 1
+            if value is not None:
+                values.append(value)
+        return values
+
+    def export_csv(self, stream, start=0.0, end=float("inf"), resolution="raw"):
+        for name in self._names:
+            for record in self.query(name, start, end, resolution):
+                stream.write(",".join([name, *map(str, record)]) + "\n")
+
+    def flush(self):
+        """Writes the mapped pages to disk, the records are kept by the OS anyway if only the process dies."""
+        with self._lock:
+            for file in self._files.values():
+                file.flush()
+
+    def close(self):
+        with self._lock:
+            # the rollups still being collected would be lost, they are picked up again by the next start
+            for (resolution, buckets) in self._buckets.items():
+                for (id, bucket) in sorted(buckets.items(), key=lambda item: item[1][0]):
+                    self._files[resolution].append(bucket[0], id, *bucket[1:])
+            for file in self._files.values():
+                file.close()
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Exports the recorded sensor history as CSV")
+    parser.add_argument("--path", default="history")
+    parser.add_argument("--resolution", choices=["raw", *TimeSeriesLog.RESOLUTIONS], default="raw")
+    parser.add_argument("--since", type=float, default=0, help="only export the last N hours")
+    args = parser.parse_args()
+
+    log = TimeSeriesLog(args.path)
+    log.export_csv(sys.stdout, start=time.time() - args.since * 3600 if args.since else 0.0, resolution=args.resolution)
+    log.close()
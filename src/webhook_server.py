@@ -0,0 +1,107 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class WebhookServer:
+    """Local stand-in for the discord webhook endpoint, used to test notifications offline.
+
+    While `fail_status` is set, every request is answered with that status and its message is not recorded, e.g.
+    503 for an outage or 429 for a rate limit.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, delay=0.0, fail_status=None):
+        # artificial processing time per request in seconds
+        self.delay = delay
+        self.fail_status = fail_status
+        self.messages = []
+        self.requests = 0
+        self.failures = 0
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # keep-alive, like discord.com
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if server.delay:
+                    time.sleep(server.delay)
+
+                status = server.fail_status
+                if status is not None:
+                    server.failures += 1
+                    self.send_response(status)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                server.requests += 1
+                server.messages.append((time.monotonic(), json.loads(body)["content"]))
+
+                self.send_response(204)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, name="webhook-server", daemon=True)
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/api/webhooks/local"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+if __name__ == "__main__":
+    import argparse
+    from statistics import mean, quantiles
+
+    parser = argparse.ArgumentParser(description="Measures notifier throughput and latency against a local webhook")
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--delay", type=float, default=0.05, help="simulated round trip of the webhook in seconds")
+    parser.add_argument("--batch-delay", type=float, default=0.05)
+    parser.add_argument("--outage", type=float, default=0, help="seconds the webhook answers 503 from the start")
+    parser.add_argument("--max-backoff", type=float, default=2, help="longest delay between retries in seconds")
+    parser.add_argument("--outbox", default=":memory:", help="SQLite file of the notifier outbox")
+    args = parser.parse_args()
+
+    from discord import Notifier
+
+    server = WebhookServer(delay=args.delay, fail_status=503 if args.outage else None).start()
+    notifier = Notifier(server.url, outbox=args.outbox, max_messages=args.messages, batch_delay=args.batch_delay,
+                        max_backoff=args.max_backoff).start()
+    if args.outage:
+        recovery = threading.Timer(args.outage, setattr, (server, "fail_status", None))
+        recovery.start()
+
+    send_latency = []
+    start = time.monotonic()
+    for i in range(args.messages):
+        before = time.perf_counter()
+        notifier.send(f"message {i}")
+        send_latency.append(time.perf_counter() - before)
+    notifier.close(timeout=60 + args.outage)
+    elapsed = time.monotonic() - start
+
+    server.stop()
+
+    p50, p95, p99 = (quantiles(send_latency, n=100)[i] for i in (49, 94, 98))
+    delivered = [message for (_, content) in server.messages for message in content.split("\n")]
+    print(f"messages delivered: {notifier.sent}/{args.messages} in {server.requests} requests, "
+          f"{'in order' if delivered == [f'message {i}' for i in range(args.messages)] else 'NOT in order'}")
+    if args.outage:
+        print(f"outage: {server.failures} failed posts, {notifier.retries} retries, "
+              f"drained {server.messages[-1][0] - start - args.outage:.2f}s after recovery")
+    print(f"throughput: {notifier.sent / elapsed:.0f} messages/s")
+    print(f"send() latency: mean {mean(send_latency) * 1e6:.1f}us p50 {p50 * 1e6:.1f}us p95 {p95 * 1e6:.1f}us p99 {p99 * 1e6:.1f}us")
@@ -0,0 +1,86 @@
+import os
+
+DISARM = "disarm"
+DOOM = "doom"
+ROLES = (DISARM, DOOM)
+
+def pack(tag_id):
+    """Packs a tag ID from a list of bytes or a hex string like "04:A2:1B:3C:5D:6E:80" into the index key."""
+    if isinstance(tag_id, str):
+        return bytes.fromhex(tag_id.replace(":", ""))
+    return bytes(tag_id)
+
+def parse(lines, source="whitelist"):
+    """Returns the index of whitelist lines like "04A21B3C5D6E80 doom", the role defaults to disarm.
+
+    Empty lines and everything after # are ignored.
+    """
+    index = {}
+    for (number, line) in enumerate(lines, 1):
+        fields = line.split("#", 1)[0].split()
+        if not fields:
+            continue
+        role = fields[1] if len(fields) > 1 else DISARM
+        if len(fields) > 2 or role not in ROLES:
+            raise ValueError(f"{source}:{number}: expected a tag ID and one of {', '.join(ROLES)}")
+        try:
+            index[pack(fields[0])] = role
+        except ValueError:
+            raise ValueError(f"{source}:{number}: invalid tag ID {fields[0]!r}") from None
+    return index
+
+class TagWhitelist:
+    """Roles of NFC tags by their full ID, read from a file which is reloaded when it changes.
+
+    The IDs are kept packed in a hash index, so a lookup costs the same for a hundred or a hundred thousand
+    cards. Until a file was loaded, tags are recognised by the last byte of their ID if `legacy_suffixes` maps
+    bytes to roles, otherwise no tag is. A file removed later doesn't change the index.
+    """
+
+    def __init__(self, path, legacy_suffixes=None):
+        self.path = path
+        self._legacy_suffixes = legacy_suffixes or {}
+        # replaced as a whole on reload, so lookups from another thread never see a half built index
+        self._index = None
+        self._stamp = None
+
+    def __len__(self):
+        return len(self._index) if self._index is not None else 0
+
+    def lookup(self, tag_id):
+        """Returns the role of a tag, or None if it isn't whitelisted."""
+        index = self._index
+        if index is None:
+            return self._legacy_suffixes.get(tag_id[-1]) if len(tag_id) else None
+        return index.get(pack(tag_id))
+
+    def reload(self):
+        """Reads the file again if it changed, returns True if the index was replaced.
+
+        A file with errors is reported and the previous index stays in use, so a half written file doesn't lock
+        everyone out. Replace the file atomically (write a copy, then rename it) to avoid that entirely.
+        """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            if self._stamp is None:
+                return False
+            # falling back to the last byte would let in any card ending in it, so keep the cards known so far
+            print(f"NFC whitelist {self.path} removed, keeping the {len(self)} tags loaded before")
+            # loaded again when it comes back
+            self._stamp = None
+            return False
+
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp == self._stamp:
+            return False
+        self._stamp = stamp
+        try:
+            with open(self.path) as f:
+                index = parse(f, self.path)
+        except (OSError, ValueError) as e:
+            print(f"NFC whitelist not reloaded: {e}")
+            return False
+        self._index = index
+        print(f"NFC whitelist loaded: {len(index)} tags")
+        return True